@@ -0,0 +1,113 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Memory allocation benchmark for the token hot paths.
+
+This uses tracemalloc to measure the peak amount of memory allocated while
+handling a single token, for tokens given as native strings and as the
+various bytes-like types, and the memory retained by each parsed token when
+results are kept as dicts or as lazy TokenData objects.  Run it with
+tokenlib importable:
+
+    python benchmarks/bench_allocations.py
+
+"""
+
+import tracemalloc
+
+import tokenlib
+
+
+CALLS = 1000
+
+#  Token data with a payload size typical of a large deployment.
+DATA = {"uid": 1234567, "node": "https://sync-1-us-west1-g.sync.services",
+        "fxa_uid": "0123456789abcdef0123456789abcdef" * 8}
+
+
+def peak_allocation(func, arg):
+    """Get the average peak memory allocated during a call to func(arg)."""
+    func(arg)
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(CALLS):
+            _reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            result = func(arg)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+            del result
+    finally:
+        tracemalloc.stop()
+    return total / CALLS
+
+
+def _reset_peak():
+    """Reset the peak traced memory, restarting tracing if need be."""
+    reset_peak = getattr(tracemalloc, "reset_peak", None)
+    if reset_peak is not None:
+        reset_peak()
+    else:
+        # Before Python 3.9 the only way to reset the peak is to discard
+        # all the traces and start again.
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+def retained_allocation(func, args):
+    """Get the average memory retained by each result of func(arg)."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        results = [func(arg) for arg in args]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del results
+    return (after - before) / len(args)
+
+
+def main():
+    for token_format in ("json", "compact"):
+        manager = tokenlib.TokenManager(token_format=token_format)
+        token = manager.make_token(DATA)
+        token_bytes = token.encode("ascii")
+        inputs = (
+            ("str", token),
+            ("bytes", token_bytes),
+            ("bytearray", bytearray(token_bytes)),
+            ("memoryview", memoryview(token_bytes)),
+        )
+        print("%s tokens, %d bytes:" % (token_format, len(token)))
+        for operation in ("parse_token", "get_derived_secret"):
+            func = getattr(manager, operation)
+            for label, value in inputs:
+                print("  %-20s %-10s %8.0f bytes peak" % (
+                    operation, label, peak_allocation(func, value)))
+        tokens = [manager.make_token(DATA) for _ in range(CALLS)]
+        for lazy in (False, True):
+            parser = tokenlib.TokenManager(token_format=token_format,
+                                           lazy_token_data=lazy)
+            label = "TokenData" if lazy else "default"
+            print("  %-20s %-10s %8.0f bytes retained" % (
+                "parse_token", label,
+                retained_allocation(parser.parse_token, tokens)))
+            print("  %-20s %-10s %8.0f bytes retained" % (
+                "parse_token['uid']", label,
+                retained_allocation(_touch(parser.parse_token), tokens)))
+
+
+def _touch(func):
+    """Wrap func so that a field of each result is accessed."""
+    def touch(arg):
+        result = func(arg)
+        result["uid"]  # pylint: disable=pointless-statement
+        return result
+    return touch
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Benchmark for compressing the payload of compact tokens.
+
+This compares the length of tokens, and the time taken to make them and to
+parse them and read a field, with and without compression, for payloads of
+increasing size.  Compression only pays off once the token is large enough
+that the smaller base64 and HMAC work outweighs the cost of zlib.  Run it
+with tokenlib importable:
+
+    python benchmarks/bench_compression.py
+
+"""
+
+import timeit
+
+import tokenlib
+
+
+NUMBER = 2000
+REPEAT = 5
+
+SCOPE_COUNTS = (1, 4, 16, 64, 256)
+
+
+def make_data(num_scopes):
+    """Get token data with the given number of scope URLs."""
+    return {"uid": 1234567, "node": "https://sync-1-us-west1-g.sync",
+            "scopes": ["https://identity.mozilla.com/apps/scope%d" % i
+                       for i in range(num_scopes)]}
+
+
+def best_time(func, arg):
+    """Get the best time per call of func(arg), in microseconds."""
+    timings = timeit.repeat(lambda: func(arg), number=NUMBER, repeat=REPEAT)
+    return min(timings) / NUMBER * 1e6
+
+
+def main():
+    managers = (
+        ("plain", tokenlib.TokenManager(token_format="compact")),
+        ("zlib", tokenlib.TokenManager(token_format="compact",
+                                       compress_threshold=0)),
+    )
+    print("%-7s %-6s %8s %10s %10s" % ("scopes", "mode", "length",
+                                       "make", "parse"))
+    for num_scopes in SCOPE_COUNTS:
+        data = make_data(num_scopes)
+        for label, manager in managers:
+            token = manager.make_token(data)
+
+            def parse(token, manager=manager):
+                return manager.parse_token(token)["scopes"]
+
+            print("%-7d %-6s %8d %7.2f us %7.2f us" % (
+                num_scopes, label, len(token),
+                best_time(manager.make_token, data), best_time(parse, token)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Micro-benchmark for the cost of keying a HMAC object per signature.
+
+This compares signing a typical ~150-byte token payload by creating a
+fresh HMAC object each time against copying an object that was keyed
+once up front, which is what TokenManager does.  Run it with:
+
+    python benchmarks/bench_hmac_keying.py
+
+"""
+
+import os
+import hmac
+import timeit
+import hashlib
+
+
+PAYLOAD_SIZE = 150
+NUMBER = 100000
+REPEAT = 5
+
+
+def main():
+    key = os.urandom(32)
+    payload = os.urandom(PAYLOAD_SIZE)
+    for hashmod in (hashlib.sha256, hashlib.sha512):
+        keyed = hmac.new(key, digestmod=hashmod)
+
+        def rekey():
+            return hmac.new(key, payload, hashmod).digest()
+
+        def copy():
+            h = keyed.copy()
+            h.update(payload)
+            return h.digest()
+
+        assert rekey() == copy()
+        name = hashmod().name
+        timings = {}
+        for label, func in (("re-key", rekey), ("pre-keyed", copy)):
+            best = min(timeit.repeat(func, number=NUMBER, repeat=REPEAT))
+            timings[label] = best / NUMBER * 1e6
+            print("%-7s %-10s %6.3f usec/token" % (name, label,
+                                                   timings[label]))
+        saving = timings["re-key"] - timings["pre-keyed"]
+        print("%-7s saving     %6.3f usec/token (%.0f%%)" % (
+            name, saving, 100.0 * saving / timings["re-key"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Benchmark suite for the tokenlib hot paths.
+
+This times each of the main token operations across a range of hash
+functions, payload sizes and token formats, for valid, invalid and
+expired inputs.  Run it with tokenlib importable (e.g. after "make build"):
+
+    python benchmarks/suite.py --output results.json
+
+Results are written as JSON, and can be compared against a previously
+stored baseline; the exit status is non-zero if any scenario got slower
+by more than the given threshold:
+
+    python benchmarks/suite.py --compare baseline.json --threshold 0.1
+
+To see where the time goes in a particular scenario, use --profile to run
+it under cProfile and print (or, with --profile-output, dump) the stats:
+
+    python benchmarks/suite.py --profile parse_token/sha256/json/medium/valid
+
+"""
+
+import os
+import re
+import atexit
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import tempfile
+import cProfile
+import pstats
+
+import tokenlib
+from tokenlib.metrics import InMemoryMetrics
+from tokenlib.shared import SharedTokenCache
+from tokenlib.utils import HKDF, strings_differ, encode_token_bytes
+
+
+HASHMODS = ("sha1", "sha256", "sha512")
+
+FORMATS = ("json", "compact")
+
+#  Token data of various sizes; "medium" gives a ~150-byte payload.
+PAYLOADS = {
+    "small": {"uid": 42},
+    "medium": {"uid": 1234567, "node": "https://sync-1-us-west1-g.sync",
+               "fxa_uid": "0123456789abcdef0123456789abcdef"},
+    "large": {"uid": 1234567, "node": "https://sync-1-us-west1-g.sync",
+              "scopes": ["https://identity.mozilla.com/apps/scope%d" % i
+                         for i in range(40)]},
+}
+
+#  Functions that generate (name, function) pairs for scenarios to time.
+SCENARIO_GROUPS = []
+
+
+def scenario_group(func):
+    """Decorator to register a generator of benchmark scenarios."""
+    SCENARIO_GROUPS.append(func)
+    return func
+
+
+def iter_scenarios():
+    for group in SCENARIO_GROUPS:
+        for name, func in group():
+            yield name, func
+
+
+@scenario_group
+def token_scenarios():
+    for hashmod in HASHMODS:
+        for token_format in FORMATS:
+            manager = tokenlib.TokenManager(secret="benchmark",
+                                            hashmod=hashmod,
+                                            token_format=token_format)
+            for size, data in sorted(PAYLOADS.items()):
+                prefix = "%s/%s/%s" % (hashmod, token_format, size)
+                yield ("make_token/" + prefix,
+                       _bind(manager.make_token, data))
+                valid = manager.make_token(data)
+                expired = manager.make_token(dict(data, expires=1))
+                # Flip a bit in the signature, leaving the payload intact.
+                raw = bytearray(tokenlib.utils.decode_token_bytes(valid))
+                raw[-1] ^= 1
+                forged = encode_token_bytes(bytes(raw))
+                inputs = (("valid", valid), ("invalid", forged),
+                          ("expired", expired))
+                for label, token in inputs:
+                    yield ("parse_token/%s/%s" % (prefix, label),
+                           _bind(_swallow_errors(manager.parse_token), token))
+                yield ("get_derived_secret/" + prefix,
+                       _bind(manager.get_derived_secret, valid))
+
+
+@scenario_group
+def primitive_scenarios():
+    for hashmod in HASHMODS:
+        hashfunc = getattr(__import__("hashlib"), hashmod)
+        size = hashfunc().digest_size
+        yield ("HKDF/%s" % (hashmod,),
+               _bind(HKDF, b"S" * 32, b"salt", b"info", size, hashfunc))
+    for size in (32, 64):
+        a = os.urandom(size)
+        b = bytes(bytearray(a))
+        yield ("strings_differ/%d/equal" % (size,), _bind(strings_differ, a, b))
+        c = b"\x00" + a[1:]
+        yield ("strings_differ/%d/differ" % (size,),
+               _bind(strings_differ, a, c))
+
+
+@scenario_group
+def input_type_scenarios():
+    data = PAYLOADS["medium"]
+    for token_format in FORMATS:
+        manager = tokenlib.TokenManager(secret="benchmark",
+                                        token_format=token_format)
+        token = manager.make_token(data)
+        token_bytes = token.encode("ascii")
+        inputs = (("str", token), ("bytes", token_bytes),
+                  ("memoryview", memoryview(token_bytes)))
+        for label, value in inputs:
+            for operation in ("parse_token", "get_derived_secret"):
+                yield ("input/%s/%s/%s" % (token_format, label, operation),
+                       _bind(getattr(manager, operation), value))
+        manager = tokenlib.TokenManager(secret="benchmark",
+                                        token_format=token_format,
+                                        return_bytes=True)
+        yield ("input/%s/bytes/make_token" % (token_format,),
+               _bind(manager.make_token, data))
+
+
+@scenario_group
+def derivation_scenarios():
+    purposes = ("", "signing", "encryption")
+    for hashmod in HASHMODS:
+        manager = tokenlib.TokenManager(secret="benchmark", hashmod=hashmod)
+        token = manager.make_token(PAYLOADS["medium"])
+
+        def one_at_a_time(manager=manager, token=token):
+            for _ in purposes:
+                manager.get_derived_secret(token)
+
+        yield ("derive/%s/3-purposes/separate" % (hashmod,), one_at_a_time)
+        yield ("derive/%s/3-purposes/single-pass" % (hashmod,),
+               _bind(manager.get_derived_secrets, token, purposes))
+
+
+@scenario_group
+def instrumentation_scenarios():
+    data = PAYLOADS["medium"]
+    for label, metrics in (("disabled", None),
+                           ("in-memory", InMemoryMetrics())):
+        manager = tokenlib.TokenManager(secret="benchmark", metrics=metrics)
+        token = manager.make_token(data)
+        yield ("metrics/%s/parse_token" % (label,),
+               _bind(manager.parse_token, token))
+
+
+@scenario_group
+def rejection_scenarios():
+    # Hostile inputs should fail fast, long before any hashing is done.
+    manager = tokenlib.TokenManager(secret="benchmark", max_token_length=4096)
+    valid = manager.make_token(PAYLOADS["small"])
+    inputs = (("forged", valid[:-4] + "AAAA"),
+              ("bad-alphabet", "!" + valid[1:]),
+              ("bad-padding", valid[:-1]),
+              ("too-short", valid[:8]),
+              ("too-long", "A" * (1 << 20)))
+    for label, token in inputs:
+        yield ("reject/" + label,
+               _bind(_swallow_errors(manager.parse_token), token))
+
+
+@scenario_group
+def compression_scenarios():
+    # Parsed tokens are read in full, so that the body is decompressed.
+    manager = tokenlib.TokenManager(secret="benchmark", token_format="compact",
+                                    compress_threshold=0)
+    for size, data in sorted(PAYLOADS.items()):
+        token = manager.make_token(data)
+        yield ("compress/%s/make_token" % (size,),
+               _bind(manager.make_token, data))
+        yield ("compress/%s/parse_token" % (size,),
+               _bind(lambda token: dict(manager.parse_token(token)), token))
+
+
+#  The shared cache used by shared_cache_scenarios(), created on first use.
+_SHARED_CACHE = []
+
+
+def _get_shared_cache():
+    """Get a shared cache in a temporary directory, removed at exit."""
+    if not _SHARED_CACHE:
+        tempdir = tempfile.TemporaryDirectory()
+        cache = SharedTokenCache(os.path.join(tempdir.name, "tokens.cache"))
+
+        def cleanup():
+            cache.close()
+            tempdir.cleanup()
+
+        atexit.register(cleanup)
+        _SHARED_CACHE.append(cache)
+    return _SHARED_CACHE[0]
+
+
+@scenario_group
+def shared_cache_scenarios():
+    # A second manager stands in for another worker process, so that every
+    # call after the first is served from entries it did not write.
+    cache = _get_shared_cache()
+    writer = tokenlib.TokenManager(secret="benchmark", shared_cache=cache)
+    reader = tokenlib.TokenManager(secret="benchmark", shared_cache=cache)
+    token = writer.make_token(PAYLOADS["medium"])
+    writer.get_derived_secret(token)
+    yield ("shared/get_derived_secret/hit",
+           _bind(reader.get_derived_secret, token))
+
+
+def _bind(func, *args):
+    """Bind arguments to a function, without the overhead of a lambda."""
+    return lambda: func(*args)
+
+
+def _swallow_errors(func):
+    def wrapper(*args):
+        try:
+            return func(*args)
+        except tokenlib.errors.Error:
+            return None
+    return wrapper
+
+
+def time_scenario(func, min_time):
+    """Time a scenario, returning the best time per call in microseconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    # Scale up the number of calls so that each repeat takes min_time.
+    per_call = max(timer.timeit(number) / number, 1e-9)
+    number = max(1, int(min_time / per_call))
+    best = min(timer.repeat(repeat=5, number=number))
+    return best / number * 1e6, number
+
+
+def run(pattern=None, min_time=0.2, out=sys.stderr):
+    results = {}
+    for name, func in iter_scenarios():
+        if pattern is not None and not pattern.search(name):
+            continue
+        usec, number = time_scenario(func, min_time)
+        results[name] = {"usec": usec, "number": number}
+        print("%-55s %10.3f usec" % (name, usec), file=out)
+    return {
+        "meta": {
+            "tokenlib": tokenlib.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "time": time.time(),
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold, out=sys.stderr):
+    """Compare results against a baseline, returning the regressed names."""
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        change = result["usec"] / base["usec"] - 1
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions.append(name)
+        print("%-55s %+7.1f%%%s" % (name, change * 100, marker), file=out)
+    return regressions
+
+
+def profile(name, duration, output=None, out=sys.stdout):
+    funcs = dict(iter_scenarios())
+    try:
+        func = funcs[name]
+    except KeyError:
+        raise SystemExit("unknown scenario: %s" % (name,))
+    profiler = cProfile.Profile()
+    deadline = time.time() + duration
+    profiler.enable()
+    while time.time() < deadline:
+        for _ in range(1000):
+            func()
+    profiler.disable()
+    if output is not None:
+        profiler.dump_stats(output)
+    else:
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(25)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-k", "--filter",
+                        help="only run scenarios matching this regex")
+    parser.add_argument("--list", action="store_true",
+                        help="list the available scenarios and exit")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum time in seconds per timing repeat")
+    parser.add_argument("-o", "--output",
+                        help="file to write the JSON results to")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="JSON results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional slowdown counted as a regression")
+    parser.add_argument("--profile", metavar="SCENARIO",
+                        help="run a single scenario under cProfile")
+    parser.add_argument("--profile-output",
+                        help="file to dump cProfile stats to")
+    args = parser.parse_args(argv)
+    if args.list:
+        for name, _ in iter_scenarios():
+            print(name)
+        return 0
+    if args.profile:
+        profile(args.profile, max(args.min_time, 1.0), args.profile_output)
+        return 0
+    pattern = re.compile(args.filter) if args.filter else None
+    results = run(pattern, args.min_time)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Thread-scaling benchmark for the tokenlib hot paths.
+
+This runs make_token, parse_token and get_derived_secret on a single shared
+TokenManager from 1 up to N threads at once, and reports the throughput at
+each thread count along with its speedup over a single thread.  On builds
+of Python with the GIL, throughput is not expected to grow with the number
+of threads, but it should not fall either; on free-threaded builds it
+should grow roughly linearly up to the number of cores.  Run it with
+tokenlib importable, under each build of interest:
+
+    python benchmarks/threads.py --threads 8
+    python3.13t benchmarks/threads.py --threads 8 --caches --metrics
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import platform
+import threading
+
+import tokenlib
+from tokenlib.metrics import InMemoryMetrics
+
+
+DATA = {"uid": 1234567, "node": "https://sync-1-us-west1-g.sync",
+        "fxa_uid": "0123456789abcdef0123456789abcdef"}
+
+#  The number of distinct tokens each thread cycles through, so that the
+#  calls are not all for the same token.
+NUM_TOKENS = 100
+
+OPERATIONS = ("make_token", "parse_token", "get_derived_secret")
+
+
+def thread_counts(max_threads):
+    """Get the thread counts to try: powers of two, and max_threads."""
+    counts = []
+    count = 1
+    while count < max_threads:
+        counts.append(count)
+        count *= 2
+    counts.append(max_threads)
+    return counts
+
+
+def measure(manager, operation, num_threads, duration):
+    """Get the total number of calls per second made across all threads."""
+    if operation == "make_token":
+        args = [DATA] * NUM_TOKENS
+    else:
+        args = [manager.make_token(DATA) for _ in range(NUM_TOKENS)]
+    func = getattr(manager, operation)
+    barrier = threading.Barrier(num_threads + 1)
+    counts = [0] * num_threads
+    stop = []
+
+    def run(index):
+        # Each thread has its own copy of the inputs, starting at a
+        # different offset, so that the only state shared between threads
+        # is that of the manager.
+        offset = index % len(args)
+        own_args = args[offset:] + args[:offset]
+        calls = 0
+        barrier.wait()
+        while not stop:
+            for arg in own_args:
+                func(arg)
+            calls += len(own_args)
+        counts[index] = calls
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    time.sleep(duration)
+    stop.append(True)
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def gil_status():
+    """Describe whether this build of Python is running with a GIL."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    if is_gil_enabled is None:
+        return "GIL"
+    return "GIL" if is_gil_enabled() else "free-threaded"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="the largest number of threads to run")
+    parser.add_argument("--duration", type=float, default=1.0,
+                        help="seconds to run each measurement for")
+    parser.add_argument("--caches", action="store_true",
+                        help="enable the secret and token caches")
+    parser.add_argument("--metrics", action="store_true",
+                        help="report metrics to an in-memory sink")
+    args = parser.parse_args(argv)
+
+    kwds = {}
+    if args.caches:
+        kwds.update(secret_cache_size=10000, token_cache_size=10000)
+    if args.metrics:
+        kwds["metrics"] = InMemoryMetrics()
+    manager = tokenlib.TokenManager(secret="benchmark", **kwds)
+    print("%s %s (%s), %d cores" % (platform.python_implementation(),
+                                     platform.python_version(),
+                                     gil_status(), os.cpu_count() or 1))
+    print("%-20s %8s %12s %8s" % ("operation", "threads", "calls/sec",
+                                  "speedup"))
+    for operation in OPERATIONS:
+        baseline = None
+        for num_threads in thread_counts(args.threads):
+            rate = measure(manager, operation, num_threads, args.duration)
+            if baseline is None:
+                baseline = rate
+            print("%-20s %8d %12.0f %7.2fx" % (operation, num_threads, rate,
+                                               rate / baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
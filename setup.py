@@ -41,8 +41,11 @@ setup(name                 = NAME,
       extras_require       = EXTRAS_REQUIRE,
       test_suite           = NAME,
       zip_safe             = False,
+      python_requires      = '>=3.7',
       classifiers          = [
           "Intended Audience :: Developers",
           "Programming Language :: Python",
+          "Programming Language :: Python :: 3",
+          "Programming Language :: Python :: 3 :: Only",
           "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)" ] )
 
@@ -16,16 +16,25 @@ __keywords__     = 'authentication token'
 
 
 import os
+import re
 import logging
 import time
-import json
-import hmac
 import hashlib
 import warnings
+import itertools
+import threading
 from binascii import hexlify
 
 from tokenlib import errors
-from tokenlib.utils import (strings_differ, HKDF,
+from tokenlib.cache import ShardedExpiringLRUCache
+from tokenlib.metrics import PhaseTimer
+from tokenlib.backends import get_backend
+from tokenlib.shared import KEY_SIZE
+from tokenlib.formats import (FORMATS, FORMAT_JSON, FORMAT_COMPACT,
+                              DEFAULT_MAX_DECOMPRESSED_SIZE,
+                              encode_payload, decode_payload,
+                              is_compressed_payload, TokenData)
+from tokenlib.utils import (HKDF, HKDF_extract, HKDF_expand, token_to_bytes,
                             encode_token_bytes, decode_token_bytes)
 
 
@@ -38,11 +47,22 @@ logger = logging.getLogger('tokenlib')
 DEFAULT_SECRET = os.urandom(32)
 DEFAULT_TIMEOUT = 5 * 60
 DEFAULT_HASHMOD = "sha256"
+DEFAULT_FORMAT = FORMAT_JSON
+DEFAULT_INVALID_TOKEN_CACHE_TTL = 60
+DEFAULT_REGISTRY_SIZE = 100
+
+
+#  Valid tokens consist of urlsafe base64 characters plus padding.
+_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]*={0,2}\Z")
+_TOKEN_BYTES_RE = re.compile(_TOKEN_RE.pattern.encode("ascii"))
+
+_INFINITY = float("inf")
 
 
 #  Unique info strings for mixing into HKDF.
 HKDF_INFO_SIGNING = b"services.mozilla.com/tokenlib/v1/signing"
 HKDF_INFO_DERIVE = b"services.mozilla.com/tokenlib/v1/derive/"
+HKDF_INFO_SHARED_CACHE = b"services.mozilla.com/tokenlib/v1/shared-cache"
 
 
 class TokenManager(object):
@@ -55,7 +75,8 @@ class TokenManager(object):
 
     The TokenManager must be initialized with a "master secret" which is used
     to crytographically secure the tokens.  Each token consists of a JSON
-    object with an appended HMAC signature.  Tokens also have a corresponding
+    object, or a compact binary encoding of one, with an appended HMAC
+    signature.  Tokens also have a corresponding
     "derived secret" generated using HKDF, which can be given to clients for
     use in signature-based authentication schemes.
 
@@ -69,9 +90,83 @@ class TokenManager(object):
        * hashmod:  the hashing module to use for various HMAC operations;
                    if not specified then hashlib.sha256 will be used
 
+       * secret_cache_size:  if non-zero, the maximum number of derived
+                             secrets to keep in an LRU cache; entries are
+                             dropped once their token has expired.
+
+       * token_cache_size:  if non-zero, the maximum number of successfully
+                            parsed tokens to keep in an LRU cache, so that
+                            repeated parsing of the same token can skip the
+                            signature check; entries are dropped once their
+                            token has expired.
+
+       * invalid_token_cache_size:  if non-zero, the maximum number of
+                                    malformed or badly-signed tokens to keep
+                                    in an LRU cache, so that they can be
+                                    rejected cheaply if they are replayed.
+
+       * invalid_token_cache_ttl:  the time for which invalid tokens are
+                                   remembered, in seconds.
+
+       * backend:  the crypto backend to use for HMAC operations, either as
+                   a tokenlib.backends.Backend object or by name; if not
+                   specified then the default "hmac" backend will be used.
+
+       * token_format:  the payload format for new tokens, either "json" or
+                        "compact"; if not specified then "json" will be used.
+                        Tokens in either format can always be parsed.
+
+       * metrics:  a tokenlib.metrics.MetricsSink to which counts and timings
+                   of each operation will be reported; if not specified then
+                   no instrumentation is done.
+
+       * return_bytes:  if true, tokens and derived secrets are returned as
+                        bytes rather than as native strings.
+
+       * revocation:  a tokenlib.revocation.RevocationFilter of tokens that
+                      have been revoked before their expiry time; if given,
+                      parse_token() will reject tokens found in the filter.
+
+       * max_token_length:  if given, tokens longer than this are rejected
+                            as malformed before doing any other work.
+
+       * lazy_token_data:  if true, tokens are parsed to a read-only
+                           tokenlib.formats.TokenData mapping rather than
+                           a dict.
+
+       * shared_cache:  a tokenlib.shared.SharedTokenCache in which to record
+                        derived secrets, so that other processes using the
+                        same cache file and master secret need not repeat
+                        the work.  Tokens are always verified in full, as
+                        looking one up in the shared cache costs about as
+                        much as checking its signature.
+
+       * compress_threshold:  if given, the data in new tokens is compressed
+                              if it encodes to at least this many bytes;
+                              this requires the "compact" token format.
+
+       * max_decompressed_size:  the largest size to which the data in a
+                                 compressed token may decompress, in bytes;
+                                 larger tokens are rejected as malformed.
+
+    Tokens may be passed to this class either as native strings or as any
+    bytes-like object, such as the bytes of a raw HTTP header value.
+
+    TokenManager objects are safe to share between threads, including on
+    free-threaded builds of Python.  Their settings must not be changed
+    after construction; the per-call work uses no shared mutable state
+    beyond the optional caches and metrics sink, which are split into
+    independently-locked shards so that threads rarely contend for them.
+
     """
 
-    def __init__(self, secret=None, timeout=None, hashmod=None):
+    def __init__(self, secret=None, timeout=None, hashmod=None,
+                 secret_cache_size=0, token_cache_size=0,
+                 invalid_token_cache_size=0, invalid_token_cache_ttl=None,
+                 backend=None, token_format=None, metrics=None,
+                 return_bytes=False, revocation=None, max_token_length=None,
+                 lazy_token_data=False, shared_cache=None,
+                 compress_threshold=None, max_decompressed_size=None):
         if secret is None:
             secret = DEFAULT_SECRET
         if not isinstance(secret, bytes):
@@ -85,37 +180,261 @@ class TokenManager(object):
         self.secret = secret
         self.timeout = timeout
         self.hashmod = hashmod
+        self.backend = get_backend(backend)
+        if token_format is None:
+            token_format = DEFAULT_FORMAT
+        if token_format not in FORMATS:
+            raise ValueError("unknown token format: %r" % (token_format,))
+        self.token_format = token_format
+        if compress_threshold is not None and token_format != FORMAT_COMPACT:
+            raise ValueError("compression requires the compact token format")
+        self.compress_threshold = compress_threshold
+        if max_decompressed_size is None:
+            max_decompressed_size = DEFAULT_MAX_DECOMPRESSED_SIZE
+        self.max_decompressed_size = max_decompressed_size
+        self.metrics = metrics
+        self.return_bytes = return_bytes
+        self.revocation = revocation
+        self.max_token_length = max_token_length
+        self.lazy_token_data = lazy_token_data
+        self.shared_cache = shared_cache
         hashobj = hashmod()
         self.hashmod_name = hashobj.name
         self.hashmod_digest_size = hashobj.digest_size
         self._sig_secret = HKDF(self.secret, salt=None,
                                 info=HKDF_INFO_SIGNING,
                                 size=self.hashmod_digest_size,
-                                hashmod=self.hashmod)
+                                hashmod=self.hashmod,
+                                backend=self.backend)
+        # A token must have at least one byte of payload before its
+        # signature; this is the shortest base64 encoding of such a thing.
+        self._min_token_length = 4 * ((self.hashmod_digest_size + 3) // 3)
+        # This lets the backend do any per-key setup, such as keying a
+        # HMAC object, just once rather than for every signature.
+        self._sig_signer = self.backend.signer(self._sig_secret, self.hashmod)
+        if shared_cache is not None:
+            # Entries are keyed by a MAC of the token, so they can't be
+            # forged, nor confused between managers with different secrets.
+            self._shared_cache_key = HKDF(self.secret, salt=None,
+                                          info=HKDF_INFO_SHARED_CACHE,
+                                          size=32, hashmod=self.hashmod,
+                                          backend=self.backend)
+        if secret_cache_size:
+            self.secret_cache = ShardedExpiringLRUCache(secret_cache_size)
+        else:
+            self.secret_cache = None
+        if token_cache_size:
+            self.token_cache = ShardedExpiringLRUCache(token_cache_size)
+        else:
+            self.token_cache = None
+        if invalid_token_cache_size:
+            self.invalid_token_cache = \
+                ShardedExpiringLRUCache(invalid_token_cache_size)
+        else:
+            self.invalid_token_cache = None
+        if invalid_token_cache_ttl is None:
+            invalid_token_cache_ttl = DEFAULT_INVALID_TOKEN_CACHE_TTL
+        self.invalid_token_cache_ttl = invalid_token_cache_ttl
+
+    def __getstate__(self):
+        # The signer may hold keyed HMAC objects or closures, which can't be
+        # pickled; it is rebuilt from the signing secret when unpickling.
+        state = self.__dict__.copy()
+        del state["_sig_signer"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sig_signer = self.backend.signer(self._sig_secret, self.hashmod)
 
     def make_token(self, data):
         """Generate a new token embedding the given dict of data.
 
         The token is a JSON dump of the given data along with an expiry
-        time and salt.  It has a HMAC signature appended and is b64-encoded
-        for transmission.
+        time and salt, or a more compact binary encoding thereof if the
+        manager uses the "compact" token format.  It has a HMAC signature
+        appended and is b64-encoded for transmission.
+        """
+        if self.metrics is None:
+            return self._make_token(data, None, None)
+        return self._instrumented("make_token", self._make_token,
+                                  data, None, None)
+
+    def make_tokens(self, datas, max_workers=None):
+        """Generate a new token for each dict of data in the given iterable.
+
+        This is equivalent to calling make_token() on each item, but shares
+        the per-call setup across the whole batch: the clock is read once,
+        and the random salts are drawn from a single call to os.urandom().
+
+        The return value is a list with one entry per input item, in order.
+        Each entry is either the generated token or the exception instance
+        that was raised while generating it; a failing item does not abort
+        the rest of the batch.
+
+        If max_workers is given then large batches are split into chunks and
+        processed concurrently on a thread pool of that size.
         """
-        data = data.copy()
+        datas = list(datas)
+        now = time.time()
+        salts = hexlify(os.urandom(3 * len(datas))).decode("ascii")
+
+        def make_one(i):
+            try:
+                salt = salts[i * 6:(i + 1) * 6]
+                if self.metrics is None:
+                    return self._make_token(datas[i], now, salt)
+                return self._instrumented("make_token", self._make_token,
+                                          datas[i], now, salt)
+            except Exception as e:  # pylint: disable=broad-except
+                return e
+
+        return _run_batch(make_one, len(datas), max_workers)
+
+    def _make_token(self, data, now, salt, timer=None):
+        """Generate a new token, using pre-computed defaults if available."""
+        data = dict(data)
         if "salt" not in data:
-            data["salt"] = hexlify(os.urandom(3)).decode("ascii")
+            if salt is None:
+                salt = hexlify(os.urandom(3)).decode("ascii")
+            data["salt"] = salt
         if "expires" not in data:
-            data["expires"] = time.time() + self.timeout
-        payload = json.dumps(data).encode("utf8")
+            if now is None:
+                now = time.time()
+            data["expires"] = now + self.timeout
+        payload = encode_payload(data, self.token_format,
+                                 self.compress_threshold)
+        if timer is not None:
+            timer.mark("payload")
         sig = self._get_signature(payload)
         assert len(sig) == self.hashmod_digest_size
-        return encode_token_bytes(payload + sig)
+        if timer is not None:
+            timer.mark("hmac")
+        return encode_token_bytes(payload + sig, self.return_bytes)
 
     def parse_token(self, token, now=None):
         """Extract the data embedded in the given token, if valid.
 
-        The token is valid if it has a valid signature and if the embedded
-        expiry time has not passed.  If the token is not valid then this
-        method raises ValueError.
+        The token is valid if it has a valid signature, if the embedded
+        expiry time has not passed, and if it has not been revoked.  If the
+        token is not valid then this method raises ValueError.
+
+        The data is returned as a dict, unless the manager was created with
+        lazy_token_data, in which case it is returned as a read-only
+        tokenlib.formats.TokenData mapping which decodes fields other than
+        "expires" and "salt" only when they are accessed.
+        """
+        if self.metrics is None:
+            return self._parse_token(token, now)
+        return self._instrumented("parse_token", self._parse_token,
+                                  token, now)
+
+    def parse_tokens(self, tokens, now=None, max_workers=None):
+        """Extract the data embedded in each of the given tokens.
+
+        This is equivalent to calling parse_token() on each item, but shares
+        the per-call setup across the whole batch, e.g. the clock is read
+        only once.
+
+        The return value is a list with one entry per input token, in order.
+        Each entry is either the dict of data embedded in the token, or an
+        instance of one of the exception classes from tokenlib.errors if the
+        token is not valid; an invalid token does not abort the rest of the
+        batch.
+
+        If max_workers is given then large batches are split into chunks and
+        processed concurrently on a thread pool of that size.
+        """
+        tokens = list(tokens)
+        if now is None:
+            now = time.time()
+
+        def parse_one(i):
+            try:
+                if self.metrics is None:
+                    return self._parse_token(tokens[i], now)
+                return self._instrumented("parse_token", self._parse_token,
+                                          tokens[i], now)
+            except errors.Error as e:
+                return e
+
+        return _run_batch(parse_one, len(tokens), max_workers)
+
+    def _parse_token(self, token, now, timer=None):
+        """Extract the data embedded in the given token, if valid.
+
+        This consults the manager's token caches, if any, before falling
+        back to fully verifying the token.
+        """
+        self._check_token_shape(token)
+        token_cache = self.token_cache
+        invalid_cache = self.invalid_token_cache
+        if token_cache is None and invalid_cache is None:
+            return self._verify_token(token, now, timer)[0]
+        if now is None:
+            now = time.time()
+        key = token
+        if not isinstance(key, (str, bytes)):
+            key = bytes(key)
+        if invalid_cache is not None:
+            error = invalid_cache.get(key, now)
+            if error is not None:
+                raise error.__class__(*error.args)
+        if token_cache is not None:
+            # Entries are only returned if their expiry is after "now",
+            # so this still enforces expiry on cache hits.  Revocation
+            # must be re-checked, as it may have happened since caching.
+            # The verified payload is decoded afresh on every hit, so that
+            # callers never share any of the (possibly mutable) data.
+            entry = token_cache.get(key, now)
+            if entry is not None:
+                payload, sig = entry
+                data = self._decode_payload(payload)
+                self._check_revocation(sig, data)
+                return data
+        try:
+            data, sig, payload = self._verify_token(token, now, timer)
+        except (errors.MalformedTokenError, errors.InvalidSignatureError) as e:
+            if invalid_cache is not None:
+                expires = time.time() + self.invalid_token_cache_ttl
+                invalid_cache.set(key, e, expires)
+            raise
+        if token_cache is not None:
+            expires = data["expires"]
+            if isinstance(expires, (int, float)):
+                token_cache.set(key, (payload, sig), expires)
+        return data
+
+    def _check_token_shape(self, token):
+        """Cheaply reject tokens that are obviously not valid.
+
+        This checks the length of the token and that it looks like urlsafe
+        base64, before any more expensive decoding or hashing is done.
+        """
+        try:
+            length = len(token)
+            if length < self._min_token_length:
+                raise errors.MalformedTokenError("token is too short")
+            if self.max_token_length is not None:
+                if length > self.max_token_length:
+                    raise errors.MalformedTokenError("token is too long")
+            if length % 4:
+                raise errors.MalformedTokenError("token has bad padding")
+            if isinstance(token, str):
+                match = _TOKEN_RE.match(token)
+            else:
+                match = _TOKEN_BYTES_RE.match(token)
+        except TypeError as e:
+            raise errors.MalformedTokenError(str(e))
+        if match is None:
+            raise errors.MalformedTokenError("token is not urlsafe base64")
+
+    def _verify_token(self, token, now, timer=None):
+        """Extract the data and signature from the given token, if valid.
+
+        This always checks the signature, expiry and revocation status of
+        the token in full, and returns a (data, signature, payload) tuple.
+        The token must already have passed _check_token_shape().
         """
         # Parse the payload and signature from the token.
         try:
@@ -124,24 +443,95 @@ class TokenManager(object):
             raise errors.MalformedTokenError(str(e))
         payload = decoded_token[:-self.hashmod_digest_size]
         sig = decoded_token[-self.hashmod_digest_size:]
+        if timer is not None:
+            timer.mark("decode")
         # Carefully check the signature.
-        # This is a deliberately slow string-compare to avoid timing attacks.
-        # Read the docstring of strings_differ for more details.
+        # This is a constant-time string-compare to avoid timing attacks.
+        # Read the docstring of tokenlib.backends.strings_differ for details.
         expected_sig = self._get_signature(payload)
-        if strings_differ(sig, expected_sig):
+        if self.backend.strings_differ(sig, expected_sig):
             raise errors.InvalidSignatureError()
+        if timer is not None:
+            timer.mark("hmac")
         # Only decode *after* we've confirmed the signature.
         # This should never fail, but well, you can't be too careful.
+        # For compact payloads this reads just the header, so that expired
+        # tokens can be rejected without decoding (or decompressing) the
+        # rest of the data.
+        max_size = self.max_decompressed_size
         try:
-            data = json.loads(payload.decode("utf8"))
+            if self.lazy_token_data:
+                data = TokenData(payload, max_size)
+            else:
+                data = decode_payload(payload, lazy=True,
+                                      max_decompressed_size=max_size)
         except ValueError as e:  # pragma: nocover
             raise errors.MalformedTokenError(str(e))
-        # Check whether it has expired.
+        if timer is not None:
+            timer.mark("payload")
+        # Check whether it has expired.  A signed token can still carry an
+        # unusable expiry time if it was made with one, e.g. a string or an
+        # infinity; those are rejected as malformed.
         if now is None:
             now = time.time()
-        if data["expires"] <= now:
+        expires = data["expires"]
+        try:
+            valid_expiry = -_INFINITY < expires < _INFINITY
+        except TypeError:
+            valid_expiry = False
+        if not valid_expiry:
+            raise errors.MalformedTokenError("invalid expiry time")
+        if expires <= now:
             raise errors.ExpiredTokenError()
-        return data
+        self._check_revocation(sig, data)
+        # Finish decoding now that the token is otherwise known to be good.
+        # Compact payloads are returned as a dict unless lazy_token_data was
+        # given, and compressed ones are decompressed here either way, so
+        # that one which decompresses to too large a size is rejected now
+        # rather than when a field is first read.
+        if isinstance(data, TokenData):
+            try:
+                if not self.lazy_token_data:
+                    data = dict(data)
+                elif is_compressed_payload(payload):
+                    len(data)
+            except ValueError as e:
+                raise errors.MalformedTokenError(str(e))
+        return data, sig, payload
+
+    def _decode_payload(self, payload):
+        """Decode the data from the given, already-verified, payload."""
+        max_size = self.max_decompressed_size
+        try:
+            if self.lazy_token_data:
+                return TokenData(payload, max_size)
+            return decode_payload(payload, max_decompressed_size=max_size)
+        except ValueError as e:  # pragma: nocover
+            raise errors.MalformedTokenError(str(e))
+
+    def _check_revocation(self, sig, data):
+        """Raise RevokedTokenError if the given token has been revoked."""
+        revocation = self.revocation
+        if revocation is not None:
+            if revocation.is_revoked(sig, data["expires"]):
+                raise errors.RevokedTokenError()
+
+    def revoke_token(self, token):
+        """Revoke the given token, so that it will no longer be accepted.
+
+        The token is added to the manager's revocation filter, which must
+        have been given to the constructor.  This raises an error if the
+        token is not valid, but revoking an expired or already-revoked
+        token does nothing.
+        """
+        if self.revocation is None:
+            raise ValueError("no revocation filter configured")
+        self._check_token_shape(token)
+        try:
+            data, sig, _ = self._verify_token(token, None)
+        except (errors.ExpiredTokenError, errors.RevokedTokenError):
+            return
+        self.revocation.revoke(sig, data["expires"])
 
     def get_token_secret(self, token):
         """Get the derived secret key associated with the given token.
@@ -159,31 +549,244 @@ class TokenManager(object):
         """Get the derived secret key associated with the given token.
 
         A per-token secret key is calculated by deriving it from the master
-        secret with HKDF.
+        secret with HKDF.  If the manager has a secret cache then the result
+        is remembered until the token expires, or for at most the manager's
+        timeout, since the token's signature is not checked here.
         """
+        if self.metrics is None:
+            return self._get_derived_secret(token)
+        return self._instrumented("get_derived_secret",
+                                  self._get_derived_secret, token)
+
+    def _get_derived_secret(self, token, timer=None):
+        """Get the derived secret key associated with the given token."""
+        cache = self.secret_cache
+        if cache is not None:
+            now = time.time()
+            key = token
+            if not isinstance(key, (str, bytes)):
+                key = bytes(key)
+            secret = cache.get(key, now)
+            if secret is not None:
+                return secret
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            if cache is None:
+                now = time.time()
+            shared_key = self._get_shared_cache_key(token)
+            entry = shared_cache.get(shared_key, now)
+            if entry is not None:
+                secret = encode_token_bytes(entry[1], self.return_bytes)
+                if cache is not None:
+                    cache.set(key, secret, entry[0], now)
+                return secret
+        data, salt = self._get_derivation_salt(token)
+        if timer is not None:
+            timer.mark("decode")
+        info = HKDF_INFO_DERIVE + token_to_bytes(token)
+        raw_secret = HKDF(self.secret, salt=salt, info=info,
+                          size=self.hashmod_digest_size, hashmod=self.hashmod,
+                          backend=self.backend)
+        secret = encode_token_bytes(raw_secret, self.return_bytes)
+        if timer is not None:
+            timer.mark("hkdf")
+        expires = data.get("expires")
+        caching = cache is not None or shared_cache is not None
+        if caching and isinstance(expires, (int, float)):
+            # The token's signature has not been checked, so a forged one
+            # could claim any expiry time.  Entries are kept no longer than
+            # a freshly-made token would last, so that forged tokens can't
+            # outlive or crowd out the entries of genuine ones.
+            max_expires = now + self.timeout
+            if not expires < max_expires:
+                expires = max_expires
+            if cache is not None:
+                cache.set(key, secret, expires, now)
+            if shared_cache is not None:
+                shared_cache.set(shared_key, expires, raw_secret, now=now)
+        return secret
+
+    def get_derived_secrets(self, token, purposes):
+        """Get several purpose-specific derived secrets for the given token.
+
+        This derives a separate secret key for each of the given purpose
+        names, e.g. one for request signing and one for encryption, and
+        returns them as a dict keyed by purpose.  The token is decoded and
+        the HKDF-Extract step is done only once for the whole set.  The
+        empty string names the default purpose, whose secret is the same
+        as that returned by get_derived_secret().
+        """
+        if self.metrics is None:
+            return self._get_derived_secrets(token, purposes)
+        return self._instrumented("get_derived_secrets",
+                                  self._get_derived_secrets, token, purposes)
+
+    def _get_derived_secrets(self, token, purposes, timer=None):
+        """Get several purpose-specific derived secrets for the given token."""
+        _, salt = self._get_derivation_salt(token)
+        if timer is not None:
+            timer.mark("decode")
+        token_bytes = token_to_bytes(token)
+        PRK = HKDF_extract(salt, self.secret, self.hashmod, self.backend)
+        secrets = {}
+        for purpose in purposes:
+            # Tokens never contain a "/" character, so this can't collide
+            # with the info string of the default purpose or each other.
+            if purpose:
+                info = HKDF_INFO_DERIVE + purpose.encode("utf8") + b"/"
+            else:
+                info = HKDF_INFO_DERIVE
+            secret = HKDF_expand(PRK, info + token_bytes,
+                                 self.hashmod_digest_size, self.hashmod,
+                                 self.backend)
+            secrets[purpose] = encode_token_bytes(secret, self.return_bytes)
+        if timer is not None:
+            timer.mark("hkdf")
+        return secrets
+
+    def _get_derivation_salt(self, token):
+        """Get the (data, salt) pair used to derive secrets for a token."""
+        self._check_token_shape(token)
         try:
             payload = decode_token_bytes(token)[:-self.hashmod_digest_size]
-            salt = json.loads(payload.decode("utf8"))["salt"].encode("ascii")
-        except (TypeError, KeyError, ValueError) as e:
+            data = TokenData(payload, self.max_decompressed_size)
+            salt = data["salt"].encode("ascii")
+        except (TypeError, KeyError, ValueError, AttributeError) as e:
             raise errors.MalformedTokenError(str(e))
-        info = HKDF_INFO_DERIVE + token.encode("ascii")
-        secret = HKDF(self.secret, salt=salt, info=info,
-                      size=self.hashmod_digest_size, hashmod=self.hashmod)
-        return encode_token_bytes(secret)
+        return data, salt
+
+    def _get_shared_cache_key(self, token):
+        """Get the key under which a token is stored in the shared cache."""
+        return hashlib.blake2b(token_to_bytes(token), digest_size=KEY_SIZE,
+                               key=self._shared_cache_key).digest()
 
     def _get_signature(self, value):
         """Calculate the HMAC signature for the given value."""
-        return hmac.new(self._sig_secret, value, self.hashmod).digest()
+        return self._sig_signer(value)
+
+    def _instrumented(self, operation, func, *args):
+        """Call func(*args), reporting its phases to the metrics sink."""
+        timer = PhaseTimer(self.metrics, operation)
+        try:
+            result = func(*args, timer=timer)
+        except Exception as e:
+            timer.reject(e)
+            raise
+        timer.finish()
+        return result
+
+
+#  Batches smaller than this are never handed off to a thread pool,
+#  as the overhead of doing so would outweigh any benefit.
+BATCH_CHUNK_SIZE = 256
+
+
+def _run_batch(func, count, max_workers=None):
+    """Call func(i) for each i in range(count), returning the results.
+
+    If max_workers is given and there is more than one chunk of work, the
+    calls are spread across a thread pool of that size.
+    """
+    if not max_workers or max_workers <= 1 or count <= BATCH_CHUNK_SIZE:
+        return [func(i) for i in range(count)]
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run_chunk(start):
+        stop = min(start + BATCH_CHUNK_SIZE, count)
+        return [func(i) for i in range(start, stop)]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        starts = range(0, count, BATCH_CHUNK_SIZE)
+        for chunk in executor.map(run_chunk, starts):
+            results.extend(chunk)
+    return results
+
+
+class TokenManagerRegistry(object):
+    """A size-bounded registry of TokenManager objects.
+
+    Constructing a TokenManager does a fair amount of work up front, such as
+    deriving the signing key via HKDF.  This class keeps a bounded LRU set of
+    managers keyed by their constructor arguments, so that code which needs a
+    manager for a given set of settings (e.g. per-tenant secrets) can look it
+    up cheaply rather than making a new one each time.  It is safe for
+    concurrent use from multiple threads, and looking up an existing manager
+    takes no locks.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = DEFAULT_REGISTRY_SIZE
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Maps each key to a [manager, last_used] list; rather than keeping
+        # the entries in order, which would need a lock on every lookup,
+        # each lookup stamps its entry and eviction looks for the oldest.
+        self._managers = {}
+        self._clock = itertools.count()
+
+    def __len__(self):
+        return len(self._managers)
+
+    def get_manager(self, secret=None, timeout=None, hashmod=None, **kwds):
+        """Get a TokenManager for the given constructor arguments.
+
+        An existing manager is returned if one was previously created with
+        equivalent arguments, otherwise a new one is created and remembered.
+        """
+        if secret is None:
+            secret = DEFAULT_SECRET
+        if not isinstance(secret, bytes):
+            secret = secret.encode("utf8")
+        key = (secret, timeout, hashmod, tuple(sorted(kwds.items())))
+        try:
+            entry = self._managers.get(key)
+        except TypeError:
+            # Unhashable arguments; we can't cache a manager for them.
+            return TokenManager(secret, timeout, hashmod, **kwds)
+        if entry is not None:
+            entry[1] = next(self._clock)
+            return entry[0]
+        # Construct the manager outside the lock so that other threads are
+        # not held up while we do so.  If several threads race to create the
+        # same manager, the first one to be stored wins.
+        manager = TokenManager(secret, timeout, hashmod, **kwds)
+        with self._lock:
+            entry = self._managers.setdefault(key, [manager, None])
+            entry[1] = next(self._clock)
+            managers = self._managers
+            while len(managers) > self.max_size:
+                del managers[min(managers, key=lambda k: managers[k][1])]
+        return entry[0]
+
+    def clear(self):
+        """Forget all the managers in the registry."""
+        with self._lock:
+            self._managers.clear()
+
+
+#  The registry of managers used by the module-level convenience functions.
+_registry = TokenManagerRegistry()
+
+
+def get_manager(**kwds):
+    """Get a shared TokenManager for the given constructor arguments.
+
+    The module-level convenience functions use this to avoid constructing
+    a new manager on every call.
+    """
+    return _registry.get_manager(**kwds)
 
 
 def make_token(data, **kwds):
     """Convenience function to make a token from the given data."""
-    return TokenManager(**kwds).make_token(data)
+    return get_manager(**kwds).make_token(data)
 
 
 def parse_token(token, now=None, **kwds):
     """Convenience function to parse data from the given token."""
-    return TokenManager(**kwds).parse_token(token, now=now)
+    return get_manager(**kwds).parse_token(token, now=now)
 
 
 def get_token_secret(token, **kwds):
@@ -191,9 +794,14 @@ def get_token_secret(token, **kwds):
 
     DEPRECATED: use get_derived_secret() instead.
     """
-    return TokenManager(**kwds).get_token_secret(token)
+    return get_manager(**kwds).get_token_secret(token)
 
 
 def get_derived_secret(token, **kwds):
     """Convenience function to get the derived secret key for a given token."""
-    return TokenManager(**kwds).get_derived_secret(token)
+    return get_manager(**kwds).get_derived_secret(token)
+
+
+def get_derived_secrets(token, purposes, **kwds):
+    """Convenience function to get purpose-specific secrets for a token."""
+    return get_manager(**kwds).get_derived_secrets(token, purposes)
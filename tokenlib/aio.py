@@ -0,0 +1,213 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+asyncio support for tokenlib.
+
+"""
+
+import copy
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from tokenlib import TokenManager
+
+
+#  The maximum number of operations to hand to the executor in one go.
+DEFAULT_MAX_BATCH_SIZE = 256
+
+
+class AsyncTokenManager(object):
+    """Awaitable wrapper around a TokenManager, for use with asyncio.
+
+    The token operations are CPU-bound, so calling them directly from a
+    coroutine will block the event loop.  This class runs them on an
+    executor instead, and tries to keep the overhead of doing so low:
+
+       * concurrent requests for the same token are coalesced, so that
+         only one of them is actually computed and the rest share its
+         result; and
+
+       * operations that arrive during the same iteration of the event
+         loop are gathered up and handed to the executor as a single batch.
+
+    The constructor takes the following arguments:
+
+       * manager:  the TokenManager (or compatible object) to wrap; if not
+                   specified then a new TokenManager is created using any
+                   other keyword arguments.
+
+       * executor:  the concurrent.futures.ThreadPoolExecutor on which to
+                    run token operations; if not specified then the event
+                    loop's default executor is used.  Process pools are not
+                    supported, as the operations share the wrapped manager.
+                    Each batch runs as a single job on one worker thread,
+                    so several workers are only kept busy when several
+                    batches are in flight at once.
+
+       * max_batch_size:  the maximum number of operations to submit to the
+                          executor in a single batch.
+
+    """
+
+    def __init__(self, manager=None, executor=None, max_batch_size=None,
+                 **kwds):
+        if manager is None:
+            manager = TokenManager(**kwds)
+        elif kwds:
+            raise TypeError("cannot specify both manager and its arguments")
+        if isinstance(executor, ProcessPoolExecutor):
+            raise TypeError("process pool executors are not supported")
+        if max_batch_size is None:
+            max_batch_size = DEFAULT_MAX_BATCH_SIZE
+        self.manager = manager
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        # In-flight operations for coalescing, keyed by operation and arg.
+        self._inflight = {}
+        # Operations waiting to be submitted to the executor.  These, and
+        # the in-flight operations, are only touched from the event loop.
+        self._queue = []
+
+    async def make_token(self, data):
+        """Generate a new token embedding the given dict of data."""
+        return await self._submit(self._make_token, data)
+
+    async def parse_token(self, token, now=None):
+        """Extract the data embedded in the given token, if valid.
+
+        Each caller gets its own copy of the data, even if its request
+        was coalesced with another.
+        """
+        return await self._submit_coalesced(self._parse_token, (token, now),
+                                            (token, now), copy_results=True)
+
+    async def get_derived_secret(self, token):
+        """Get the derived secret key associated with the given token."""
+        return await self._submit_coalesced(self._get_derived_secret, token,
+                                            (token,))
+
+    def _make_token(self, data):
+        return self.manager.make_token(data)
+
+    def _parse_token(self, args):
+        return self.manager.parse_token(*args)
+
+    def _get_derived_secret(self, token):
+        return self.manager.get_derived_secret(token)
+
+    def _submit_coalesced(self, func, arg, key_args, copy_results=False):
+        """Submit an operation, sharing it with any identical one in flight.
+
+        The operation is identified by func and key_args, the first of which
+        must be a token.  If copy_results is true then each caller other
+        than the first gets a deep copy of the result.
+        """
+        token = key_args[0]
+        try:
+            if not isinstance(token, (str, bytes)):
+                # Key other buffers, e.g. a bytearray, by their contents,
+                # just like the token caches do.
+                token = memoryview(token).tobytes()
+            key = (func.__name__, token) + key_args[1:]
+            op = self._inflight.get(key)
+        except TypeError:
+            # Not a token we can hash; we can't coalesce it.
+            return self._submit(func, arg)
+        if op is None:
+            op = self._inflight[key] = self._enqueue(func, arg, key)
+            op.copy_results = copy_results
+        # Each caller waits on its own future, so that one caller being
+        # cancelled does not cancel the operation for everyone else.
+        future = op.loop.create_future()
+        op.waiters.append(future)
+        return future
+
+    def _submit(self, func, arg):
+        op = self._enqueue(func, arg, None)
+        future = op.loop.create_future()
+        op.waiters.append(future)
+        return future
+
+    def _enqueue(self, func, arg, key):
+        loop = asyncio.get_running_loop()
+        if not self._queue:
+            loop.call_soon(self._flush, loop)
+        op = _Operation(loop, func, arg, key)
+        self._queue.append(op)
+        if len(self._queue) >= self.max_batch_size:
+            self._flush(loop)
+        return op
+
+    def _flush(self, loop):
+        """Submit all queued operations to the executor as a single batch."""
+        batch = self._queue
+        if not batch:
+            return
+        self._queue = []
+        work = [(op.func, op.arg) for op in batch]
+        try:
+            done = loop.run_in_executor(self.executor, _run_batch, work)
+        except Exception as e:  # pylint: disable=broad-except
+            # E.g. the executor has been shut down.  Fail every operation
+            # in the batch, rather than leaving its callers waiting forever.
+            # This is deferred, since a full batch is flushed before the
+            # operation that filled it has been registered.
+            loop.call_soon(self._deliver, batch, [(False, e)] * len(batch))
+            return
+
+        def deliver(done):
+            if done.cancelled():
+                results = [(False, asyncio.CancelledError())] * len(batch)
+            elif done.exception() is not None:
+                results = [(False, done.exception())] * len(batch)
+            else:
+                results = done.result()
+            self._deliver(batch, results)
+
+        done.add_done_callback(deliver)
+
+    def _deliver(self, batch, results):
+        """Hand the (ok, value) results of a batch to everyone waiting."""
+        for op, (ok, value) in zip(batch, results):
+            if op.key is not None:
+                del self._inflight[op.key]
+            delivered = False
+            for future in op.waiters:
+                if future.done():
+                    continue
+                if not ok:
+                    future.set_exception(value)
+                elif delivered and op.copy_results:
+                    # Only the extra waiters of a coalesced operation need
+                    # copies, since the manager returns fresh data each call.
+                    future.set_result(copy.deepcopy(value))
+                else:
+                    future.set_result(value)
+                delivered = True
+
+
+class _Operation(object):
+    """A queued or in-flight operation, and the futures waiting on it."""
+
+    __slots__ = ("loop", "func", "arg", "key", "waiters", "copy_results")
+
+    def __init__(self, loop, func, arg, key):
+        self.loop = loop
+        self.func = func
+        self.arg = arg
+        self.key = key
+        self.waiters = []
+        self.copy_results = False
+
+
+def _run_batch(work):
+    """Run a batch of (func, arg) calls, capturing results or exceptions."""
+    results = []
+    for func, arg in work:
+        try:
+            results.append((True, func(arg)))
+        except Exception as e:  # pylint: disable=broad-except
+            results.append((False, e))
+    return results
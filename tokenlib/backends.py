@@ -0,0 +1,147 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Pluggable crypto backends for tokenlib.
+
+A backend bundles together the low-level HMAC primitives used by the
+TokenManager class and the HKDF helpers in tokenlib.utils.  All backends
+must produce identical outputs; they differ only in how fast they are.
+
+"""
+
+import hmac
+import threading
+
+
+def strings_differ(string1, string2):
+    """Check whether two bytestrings differ while avoiding timing attacks.
+
+    This function returns True if the given strings differ and False
+    if they are equal.  It's careful not to leak information about *where*
+    they differ as a result of its running time, which can be very important
+    to avoid certain timing-related crypto attacks:
+
+        http://seb.dbzteam.org/crypto/python-oauth-timing-hmac.pdf
+
+    """
+    if len(string1) != len(string2):
+        return True
+    invalid_bits = 0
+    for a, b in zip(string1, string2):
+        invalid_bits += a ^ b
+    return invalid_bits != 0
+
+
+class Backend(object):
+    """Base class defining the interface for crypto backends.
+
+    Subclasses must implement the following methods:
+
+       * hmac_digest(key, data, hashmod):  compute the HMAC of the given
+                                           data under the given key.
+
+       * signer(key, hashmod):  return a function that will compute the
+                                HMAC of its argument under the given key;
+                                this is used when many messages are to be
+                                signed with the same key.
+
+       * strings_differ(string1, string2):  check whether two bytestrings
+                                            differ, in time that does not
+                                            depend on where they differ.
+
+    """
+
+    name = None
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.name)
+
+    def hmac_digest(self, key, data, hashmod):
+        raise NotImplementedError
+
+    def signer(self, key, hashmod):
+        raise NotImplementedError
+
+    def strings_differ(self, string1, string2):
+        raise NotImplementedError
+
+
+class PythonBackend(Backend):
+    """Reference backend built from the pure-python HMAC code paths.
+
+    This keys a new HMAC object for every message and compares strings
+    with a python-level loop.  It's mostly useful for testing the other
+    backends against.
+    """
+
+    name = "python"
+
+    def hmac_digest(self, key, data, hashmod):
+        return hmac.new(key, data, hashmod).digest()
+
+    def signer(self, key, hashmod):
+        def sign(data):
+            return hmac.new(key, data, hashmod).digest()
+        return sign
+
+    def strings_differ(self, string1, string2):
+        return strings_differ(string1, string2)
+
+
+class HMACBackend(Backend):
+    """Default backend built on the C-level helpers in the hmac module.
+
+    This uses the one-shot hmac.digest() function, copies a pre-keyed HMAC
+    object when signing many messages under the same key, and compares
+    strings with hmac.compare_digest().
+    """
+
+    name = "hmac"
+
+    def hmac_digest(self, key, data, hashmod):
+        return hmac.digest(key, data, hashmod)
+
+    def signer(self, key, hashmod):
+        keyed = hmac.new(key, digestmod=hashmod)
+        # Each thread copies from its own keyed object, so that threads
+        # never contend for the state or reference count of a shared one.
+        local = threading.local()
+
+        def sign(data):
+            try:
+                h = local.keyed.copy()
+            except AttributeError:
+                local.keyed = keyed.copy()
+                h = local.keyed.copy()
+            h.update(data)
+            return h.digest()
+
+        return sign
+
+    def strings_differ(self, string1, string2):
+        return not hmac.compare_digest(string1, string2)
+
+
+BACKENDS = {
+    PythonBackend.name: PythonBackend(),
+    HMACBackend.name: HMACBackend(),
+}
+
+DEFAULT_BACKEND = BACKENDS[HMACBackend.name]
+
+
+def get_backend(backend=None):
+    """Get a backend object, given either a backend or its name.
+
+    If no backend is specified then the default backend is returned.
+    """
+    if backend is None:
+        return DEFAULT_BACKEND
+    if isinstance(backend, str):
+        try:
+            return BACKENDS[backend]
+        except KeyError:
+            raise ValueError("unknown backend: %r" % (backend,))
+    return backend
@@ -0,0 +1,172 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Size-bounded caches for tokenlib.
+
+"""
+
+import time
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class ExpiringLRUCache(object):
+    """A size-bounded LRU cache whose entries carry an expiry time.
+
+    Each entry is stored along with an absolute expiry timestamp, and will
+    never be returned once that time has passed.  Expired entries are purged
+    as new entries are added, so they do not linger in memory past their
+    expiry time for longer than it takes to do the next write.  When the
+    cache is full, the least-recently-used entry is evicted to make room.
+
+    The cache keeps simple hit/miss counters in its "hits" and "misses"
+    attributes, and is safe for concurrent use from multiple threads.
+    """
+
+    def __init__(self, max_size):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._expiry_heap = []
+        # Tie-breaker for heap entries, so that keys are never compared.
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """Get the value stored for the given key, or None if not present."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires, now=None):
+        """Store a value for the given key, valid until the given time."""
+        if now is None:
+            now = time.time()
+        if expires <= now:
+            return
+        with self._lock:
+            self._purge_expired(now)
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            heapq.heappush(self._expiry_heap,
+                           (expires, next(self._counter), key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            # The heap may hold stale references to keys that have since been
+            # evicted or overwritten; rebuild it if they start to pile up.
+            if len(self._expiry_heap) > 2 * self.max_size:
+                self._expiry_heap = [(exp, next(self._counter), k)
+                                     for (k, (_, exp))
+                                     in self._entries.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def discard(self, key):
+        """Remove any value stored for the given key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._expiry_heap = []
+            self.hits = 0
+            self.misses = 0
+
+    def _purge_expired(self, now):
+        """Remove all entries whose expiry time has passed.
+
+        This must be called with the lock held.
+        """
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires, _, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == expires:
+                del self._entries[key]
+
+
+#  Sharded caches are split into at most this many shards by default, and
+#  never into shards smaller than MIN_SHARD_SIZE entries.
+DEFAULT_SHARDS = 16
+MIN_SHARD_SIZE = 64
+
+
+class ShardedExpiringLRUCache(object):
+    """An ExpiringLRUCache split into several independently-locked shards.
+
+    Each key is assigned to a shard by its hash, and each shard is a
+    separate ExpiringLRUCache with its own lock, so that threads working
+    with different keys rarely contend with each other.  The interface is
+    the same as for ExpiringLRUCache, except that the least-recently-used
+    entry is evicted from the shard being written to rather than from the
+    cache as a whole.  Caches too small to split into shards of at least
+    MIN_SHARD_SIZE entries behave exactly like an ExpiringLRUCache.
+    """
+
+    def __init__(self, max_size, shards=None):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        if shards is None:
+            shards = DEFAULT_SHARDS
+        shards = max(1, min(shards, max_size // MIN_SHARD_SIZE))
+        # Spread any remainder over the first few shards, so that the
+        # sizes of the shards add up to exactly max_size.
+        shard_size, remainder = divmod(max_size, shards)
+        self.max_size = max_size
+        self._shards = tuple(ExpiringLRUCache(shard_size + (i < remainder))
+                             for i in range(shards))
+
+    @property
+    def hits(self):
+        return sum(shard.hits for shard in self._shards)
+
+    @property
+    def misses(self):
+        return sum(shard.misses for shard in self._shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def _shard(self, key):
+        shards = self._shards
+        return shards[hash(key) % len(shards)]
+
+    def get(self, key, now=None):
+        """Get the value stored for the given key, or None if not present."""
+        return self._shard(key).get(key, now)
+
+    def set(self, key, value, expires, now=None):
+        """Store a value for the given key, valid until the given time."""
+        self._shard(key).set(key, value, expires, now)
+
+    def discard(self, key):
+        """Remove any value stored for the given key."""
+        self._shard(key).discard(key)
+
+    def clear(self):
+        """Remove all entries from the cache and reset the counters."""
+        for shard in self._shards:
+            shard.clear()
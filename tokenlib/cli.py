@@ -0,0 +1,188 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Command-line tool for bulk minting and verifying of tokens.
+
+This reads JSON-lines records from stdin or a file and writes one JSON-lines
+result per record to stdout, in the same order as the input.  It supports
+the following modes:
+
+   * mint:  each input record is a JSON object of token data, and each
+            output record is {"token": <token>}.
+
+   * verify:  each input record is a token, given either as a bare string,
+              a JSON string, or a JSON object with a "token" field; each
+              output record is {"token": <token>, "data": <data>}.
+
+   * derive-secret:  input records are as for "verify", and each output
+                     record is {"token": <token>, "secret": <secret>}.
+
+Records that cannot be processed produce an output record with "error" and
+"message" fields instead.  Input is processed in fixed-size chunks, with a
+bounded number of chunks in flight at any time, so memory usage does not
+grow with the size of the input.  A summary of throughput and error counts
+is written to stderr at the end.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque, Counter
+
+import tokenlib
+
+
+MODES = ("mint", "verify", "derive-secret")
+
+DEFAULT_CHUNK_SIZE = 1000
+
+#  Settings for the manager in worker processes, set by _init_worker().
+_worker_state = {}
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Entry-point for the command-line tool; returns the exit status."""
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    parser = argparse.ArgumentParser(
+        prog="python -m tokenlib",
+        description="Mint, verify or derive secrets for tokens in bulk.")
+    parser.add_argument("mode", choices=MODES)
+    parser.add_argument("-i", "--input", default="-",
+                        help="input file of JSON-lines (default: stdin)")
+    parser.add_argument("--secret", default=os.environ.get("TOKENLIB_SECRET"),
+                        help="master secret (default: $TOKENLIB_SECRET)")
+    parser.add_argument("--timeout", type=float,
+                        help="token lifetime in seconds, for minting")
+    parser.add_argument("--hashmod", help="hash function name, e.g. sha256")
+    parser.add_argument("--token-format", choices=tokenlib.formats.FORMATS,
+                        help="payload format for minted tokens")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="number of records per chunk of work")
+    args = parser.parse_args(argv)
+    if args.secret is None:
+        parser.error("a secret must be given via --secret or TOKENLIB_SECRET")
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be positive")
+    settings = {"secret": args.secret, "timeout": args.timeout,
+                "hashmod": args.hashmod, "token_format": args.token_format}
+    if args.input == "-":
+        return _run(args, settings, stdin, stdout, stderr)
+    with open(args.input) as f:
+        return _run(args, settings, f, stdout, stderr)
+
+
+def _run(args, settings, infile, outfile, errfile):
+    start = time.time()
+    counts = Counter()
+    chunks = _read_chunks(infile, args.chunk_size)
+    if args.workers == 1:
+        _init_worker(settings)
+        results = (_process_chunk((args.mode, chunk)) for chunk in chunks)
+        _write_results(results, outfile, counts)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                 initargs=(settings,)) as executor:
+            results = _map_bounded(executor, args.mode, chunks,
+                                   2 * args.workers)
+            _write_results(results, outfile, counts)
+    elapsed = max(time.time() - start, 1e-9)
+    total = counts.pop("total", 0)
+    print("%s: %d records in %.3fs (%.1f records/s)"
+          % (args.mode, total, elapsed, total / elapsed), file=errfile)
+    for name, count in sorted(counts.items()):
+        print("  %s: %d" % (name, count), file=errfile)
+    return 0
+
+
+def _read_chunks(infile, chunk_size):
+    """Generate lists of up to chunk_size non-blank lines from the input."""
+    chunk = []
+    for line in infile:
+        line = line.strip()
+        if line:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _map_bounded(executor, mode, chunks, max_pending):
+    """Like executor.map(), but with a bounded number of pending chunks.
+
+    Results are generated in input order, and no more than max_pending
+    chunks are read from the input before their results are consumed.
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(_process_chunk, (mode, chunk)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _write_results(results, outfile, counts):
+    for chunk in results:
+        for record in chunk:
+            counts["total"] += 1
+            if "error" in record:
+                counts[record["error"]] += 1
+            outfile.write(json.dumps(record))
+            outfile.write("\n")
+
+
+def _init_worker(settings):
+    _worker_state["manager"] = tokenlib.TokenManager(**settings)
+
+
+def _process_chunk(work):
+    """Process a chunk of input lines, returning a list of output records."""
+    mode, lines = work
+    manager = _worker_state["manager"]
+    results = []
+    for line in lines:
+        token = None
+        try:
+            if mode == "mint":
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("token data must be a JSON object")
+                results.append({"token": manager.make_token(data)})
+                continue
+            token = _parse_token_record(line)
+            if mode == "verify":
+                data = dict(manager.parse_token(token))
+                results.append({"token": token, "data": data})
+            else:
+                secret = manager.get_derived_secret(token)
+                results.append({"token": token, "secret": secret})
+        except Exception as e:  # pylint: disable=broad-except
+            record = {"error": e.__class__.__name__, "message": str(e)}
+            if token is not None:
+                record["token"] = token
+            results.append(record)
+    return results
+
+
+def _parse_token_record(line):
+    """Extract a token from an input line for the verify modes."""
+    if line[0] not in "\"{":
+        return line
+    record = json.loads(line)
+    if isinstance(record, dict):
+        record = record.get("token")
+    if not isinstance(record, str):
+        raise ValueError("record does not contain a token string")
+    return record
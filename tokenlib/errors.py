@@ -32,3 +32,10 @@ class InvalidSignatureError(Error):
 
     def __init__(self, message="token has invalid signature", *args):
         super(InvalidSignatureError, self).__init__(message, *args)
+
+
+class RevokedTokenError(Error):
+    """Error raised when tokenlib encounters a revoked token."""
+
+    def __init__(self, message="token has been revoked", *args):
+        super(RevokedTokenError, self).__init__(message, *args)
@@ -0,0 +1,268 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Payload formats for tokenlib.
+
+A token is a base64-encoded payload with a HMAC signature appended.  There
+are two supported formats for the payload:
+
+   * json:  the original format, a JSON dump of the token data.
+
+   * compact:  a binary format with a fixed-size header holding a version
+               byte, a flags byte, the expiry time as a big-endian double
+               and the salt as three raw bytes, followed by a compact JSON
+               dump of any other fields in the token data.  If the body is
+               large, it may be compressed with zlib, as noted in the flags.
+
+JSON payloads always begin with a "{" character, so the format of a payload
+can be detected from its first byte.
+
+"""
+
+import re
+import json
+import zlib
+import struct
+from collections.abc import Mapping
+from binascii import hexlify, unhexlify
+
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+
+FORMATS = (FORMAT_JSON, FORMAT_COMPACT)
+
+COMPACT_VERSION = b"\x02"
+
+#  Set in the flags byte if the salt could not be packed into the header,
+#  in which case it is stored along with the other fields in the body.
+FLAG_CUSTOM_SALT = 0x01
+
+#  Set in the flags byte if the body has been compressed with zlib.
+FLAG_COMPRESSED = 0x02
+
+#  The largest body that will be produced by decompressing a payload; this
+#  guards against tokens that would decompress to an enormous size.
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024
+
+_COMPACT_HEADER = struct.Struct(">cBd3s")
+COMPACT_HEADER_SIZE = _COMPACT_HEADER.size
+
+_NO_SALT = b"\x00\x00\x00"
+_PACKABLE_SALT = re.compile(r"^[0-9a-f]{6}$")
+
+_compact_json = json.JSONEncoder(separators=(",", ":")).encode
+
+#  Token bodies are small, so a small window and hash table compress them
+#  about as well as zlib's defaults while being much quicker to set up.
+_ZLIB_WBITS = 10
+_ZLIB_MEMLEVEL = 4
+
+#  The trailing fields added by TokenManager.make_token() to a JSON payload.
+#  Any nested container or string would have to close after the number, so
+#  a match can only be the last two keys of the top-level object.
+_JSON_TAIL = re.compile(
+    rb'"salt": "([0-9a-f]{6})", "expires": (-?[0-9][0-9.eE+-]*)\}\Z')
+
+
+def encode_payload(data, payload_format=FORMAT_JSON,
+                   compress_threshold=None):
+    """Encode a dict of token data into a payload of the given format.
+
+    The data must contain "expires" and "salt" fields.  If compress_threshold
+    is given then compact payloads with a body of at least that many bytes
+    are compressed; JSON payloads cannot be compressed.
+    """
+    if payload_format == FORMAT_JSON:
+        if compress_threshold is not None:
+            raise ValueError("json payloads cannot be compressed")
+        return json.dumps(data).encode("utf8")
+    if payload_format == FORMAT_COMPACT:
+        return encode_compact_payload(data, compress_threshold)
+    raise ValueError("unknown payload format: %r" % (payload_format,))
+
+
+def decode_payload(payload, lazy=False, max_decompressed_size=None):
+    """Decode a dict of token data from a payload in any known format.
+
+    If lazy is true then compact payloads are decoded into a TokenData
+    mapping, which reads only the header up front.  The payload may be any
+    bytes-like object, including a memoryview.  This raises ValueError if
+    the payload cannot be decoded, or if its body is compressed and would
+    decompress to more than max_decompressed_size bytes.
+    """
+    if payload[:1] == COMPACT_VERSION:
+        if lazy:
+            return TokenData(payload, max_decompressed_size)
+        return decode_compact_payload(payload, max_decompressed_size)
+    return json.loads(str(payload, "utf8"))
+
+
+def encode_compact_payload(data, compress_threshold=None):
+    """Encode a mapping of token data into a compact payload.
+
+    If compress_threshold is given and the body is at least that many bytes
+    long, then it is compressed if that makes it any smaller.
+    """
+    fields = dict(data)
+    try:
+        expires = float(fields.pop("expires"))
+        salt = fields.pop("salt")
+    except KeyError as e:
+        raise ValueError("missing token field: %s" % (e,))
+    flags = 0
+    if isinstance(salt, str) and _PACKABLE_SALT.match(salt):
+        packed_salt = unhexlify(salt.encode("ascii"))
+    else:
+        flags |= FLAG_CUSTOM_SALT
+        packed_salt = _NO_SALT
+        fields["salt"] = salt
+    if not fields:
+        body = b""
+    else:
+        body = _compact_json(fields).encode("utf8")
+        if compress_threshold is not None and len(body) >= compress_threshold:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, _ZLIB_WBITS,
+                                          _ZLIB_MEMLEVEL)
+            compressed = compressor.compress(body) + compressor.flush()
+            if len(compressed) < len(body):
+                flags |= FLAG_COMPRESSED
+                body = compressed
+    header = _COMPACT_HEADER.pack(COMPACT_VERSION, flags, expires, packed_salt)
+    return header + body
+
+
+def decode_compact_payload(payload, max_decompressed_size=None):
+    """Decode a dict of token data from a compact payload.
+
+    This raises ValueError if the payload cannot be decoded, or if its body
+    is compressed and would decompress to more than max_decompressed_size
+    bytes.
+    """
+    flags, expires, salt = read_compact_header(payload)
+    body = payload[COMPACT_HEADER_SIZE:]
+    if flags & FLAG_COMPRESSED:
+        body = _decompress(body, max_decompressed_size)
+    if body:
+        data = json.loads(str(body, "utf8"))
+        if not isinstance(data, dict):
+            raise ValueError("token body is not a JSON object")
+    else:
+        data = {}
+    data["expires"] = expires
+    if not flags & FLAG_CUSTOM_SALT:
+        data["salt"] = salt
+    return data
+
+
+def _decompress(body, max_size=None):
+    """Decompress a payload body, refusing to produce more than max_size."""
+    if max_size is None:
+        max_size = DEFAULT_MAX_DECOMPRESSED_SIZE
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(body, max_size)
+    except zlib.error as e:
+        raise ValueError(str(e))
+    if not decompressor.eof:
+        if decompressor.unconsumed_tail or decompressor.decompress(b"", 1):
+            raise ValueError("token body is too large")
+        raise ValueError("token body is truncated")
+    return body
+
+
+def read_compact_header(payload):
+    """Read the (flags, expires, salt) tuple from a compact payload header.
+
+    This raises ValueError if the header is malformed.
+    """
+    try:
+        version, flags, expires, salt = \
+            _COMPACT_HEADER.unpack_from(payload)
+    except struct.error as e:
+        raise ValueError(str(e))
+    if version != COMPACT_VERSION:
+        raise ValueError("unknown payload version: %r" % (version,))
+    return flags, expires, hexlify(salt).decode("ascii")
+
+
+def is_compressed_payload(payload):
+    """Check whether the given payload is compact, with a compressed body."""
+    return (payload[:1] == COMPACT_VERSION and len(payload) > 1 and
+            bool(payload[1] & FLAG_COMPRESSED))
+
+
+class TokenData(Mapping):
+    """Read-only mapping of the data in a token payload, decoded lazily.
+
+    The expiry time and salt are found when the object is created, and are
+    available as the "expires" and "salt" attributes as well as the
+    corresponding keys.  The remaining fields are only decoded the first
+    time they are accessed, and if the payload turns out to be malformed
+    then that access raises ValueError.
+
+    For compact payloads the expiry time and salt are read from the header.
+    For JSON payloads they are read from the tail of the payload, where
+    TokenManager.make_token() puts them by default; if they are not found
+    there then the whole payload is decoded up front.
+    """
+
+    __slots__ = ("expires", "salt", "_payload", "_data", "_max_size")
+
+    def __init__(self, payload, max_decompressed_size=None):
+        self._payload = payload
+        self._data = None
+        self._max_size = max_decompressed_size
+        if payload[:1] == COMPACT_VERSION:
+            flags, self.expires, self.salt = read_compact_header(payload)
+            if flags & FLAG_CUSTOM_SALT:
+                self.salt = self._decode()["salt"]
+            return
+        match = _JSON_TAIL.search(payload)
+        if match is not None:
+            self.salt = str(match.group(1), "ascii")
+            expires = match.group(2)
+            if expires.lstrip(b"-").isdigit():
+                self.expires = int(expires)
+            else:
+                self.expires = float(expires)
+            return
+        data = self._decode()
+        try:
+            self.expires = data["expires"]
+            self.salt = data["salt"]
+        except (KeyError, TypeError) as e:
+            raise ValueError("missing token field: %s" % (e,))
+
+    def __getitem__(self, key):
+        if key == "expires":
+            return self.expires
+        if key == "salt":
+            return self.salt
+        return self._decode()[key]
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __len__(self):
+        return len(self._decode())
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, dict(self._decode()))
+
+    def _decode(self):
+        data = self._data
+        if data is None:
+            payload = self._payload
+            if payload is None:
+                # Another thread decoded it since we looked; it sets _data
+                # before clearing _payload, so _data is there to be read.
+                return self._data
+            data = self._data = decode_payload(
+                payload, max_decompressed_size=self._max_size)
+            # The payload is no longer needed once it has been decoded.
+            self._payload = None
+        return data
@@ -0,0 +1,202 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Support for rotating master secrets via a keyring of identified keys.
+
+"""
+
+import re
+import time
+import threading
+
+from tokenlib import errors, TokenManager, _run_batch
+from tokenlib.utils import token_to_bytes
+
+
+#  Key ids are embedded in tokens, so they must be short and must not
+#  contain the "." character used to separate them from the token.
+KEY_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,16}\Z")
+
+
+class KeyringTokenManager(object):
+    """Class for managing tokens signed with one of several master secrets.
+
+    This class allows master secrets to be rotated without invalidating
+    all outstanding tokens at once.  It keeps a keyring of master secrets,
+    each identified by a short key id, and a TokenManager for each secret
+    so that the signing key is derived just once per secret.
+
+    New tokens are signed with the "active" key and have its key id stamped
+    on the front, separated by a "." character.  When parsing a token, its
+    key id is used to look up the corresponding manager directly, so there
+    is no need to try each key in turn.
+
+    The constructor takes the following arguments:
+
+       * keys:  a dict or list of (key id, secret) pairs for the initial
+                contents of the keyring.
+
+       * active_key:  the id of the key to use for signing new tokens;
+                      if not specified and there is only one key in the
+                      keyring then that key is used, otherwise no tokens
+                      can be made until a key is activated.
+
+    Any other keyword arguments are passed on to the TokenManager for each
+    key.  Keys can be added and retired at runtime; these operations are
+    serialized, but parsing tokens never needs to take a lock.
+    """
+
+    def __init__(self, keys=(), active_key=None, **kwds):
+        self._manager_kwds = kwds
+        self._write_lock = threading.Lock()
+        # These are only ever replaced, never modified in place, so that
+        # readers can access them without locking.
+        self._managers = {}
+        self._active = (None, None)
+        if isinstance(keys, dict):
+            keys = keys.items()
+        for key_id, secret in keys:
+            self.add_key(key_id, secret)
+        if active_key is None and len(self._managers) == 1:
+            active_key = next(iter(self._managers))
+        if active_key is not None:
+            self.activate_key(active_key)
+
+    @property
+    def key_ids(self):
+        """The ids of all keys currently in the keyring."""
+        return sorted(self._managers)
+
+    @property
+    def active_key(self):
+        """The id of the key currently used for signing new tokens."""
+        return self._active[0]
+
+    def add_key(self, key_id, secret, activate=False):
+        """Add a new key to the keyring, optionally making it active."""
+        if not KEY_ID_RE.match(key_id):
+            raise ValueError("invalid key id: %r" % (key_id,))
+        manager = TokenManager(secret, **self._manager_kwds)
+        with self._write_lock:
+            if key_id in self._managers:
+                raise ValueError("duplicate key id: %r" % (key_id,))
+            managers = self._managers.copy()
+            managers[key_id] = manager
+            self._managers = managers
+            if activate:
+                self._active = (key_id, manager)
+
+    def activate_key(self, key_id):
+        """Start signing new tokens with the given key."""
+        with self._write_lock:
+            self._active = (key_id, self._get_manager(key_id, KeyError))
+
+    def retire_key(self, key_id):
+        """Remove the given key, invalidating all tokens signed with it."""
+        with self._write_lock:
+            if key_id == self._active[0]:
+                raise ValueError("cannot retire the active key")
+            managers = self._managers.copy()
+            del managers[key_id]
+            self._managers = managers
+
+    def get_manager(self, key_id):
+        """Get the TokenManager for the given key id."""
+        return self._get_manager(key_id, KeyError)
+
+    def make_token(self, data):
+        """Generate a new token embedding the given dict of data.
+
+        The token is signed with the active key, and has its key id stamped
+        on the front.
+        """
+        key_id, manager = self._get_active()
+        return _stamp(key_id, manager.make_token(data))
+
+    def make_tokens(self, datas, max_workers=None):
+        """Generate a new token for each dict of data in the given iterable.
+
+        See TokenManager.make_tokens() for details.
+        """
+        key_id, manager = self._get_active()
+        results = manager.make_tokens(datas, max_workers=max_workers)
+        return [r if isinstance(r, Exception) else _stamp(key_id, r)
+                for r in results]
+
+    def parse_token(self, token, now=None):
+        """Extract the data embedded in the given token, if valid.
+
+        See TokenManager.parse_token() for details.  Tokens signed with a
+        key that is not in the keyring raise InvalidSignatureError.
+        """
+        manager, token = self._split_token(token)
+        return manager.parse_token(token, now=now)
+
+    def parse_tokens(self, tokens, now=None, max_workers=None):
+        """Extract the data embedded in each of the given tokens.
+
+        See TokenManager.parse_tokens() for details.
+        """
+        tokens = list(tokens)
+        if now is None:
+            now = time.time()
+
+        def parse_one(i):
+            try:
+                return self.parse_token(tokens[i], now=now)
+            except errors.Error as e:
+                return e
+
+        return _run_batch(parse_one, len(tokens), max_workers)
+
+    def get_derived_secret(self, token):
+        """Get the derived secret key associated with the given token.
+
+        The secret is derived from the master secret of the key with which
+        the token was signed.
+        """
+        manager, token = self._split_token(token)
+        return manager.get_derived_secret(token)
+
+    def get_derived_secrets(self, token, purposes):
+        """Get several purpose-specific derived secrets for the given token.
+
+        See TokenManager.get_derived_secrets() for details.
+        """
+        manager, token = self._split_token(token)
+        return manager.get_derived_secrets(token, purposes)
+
+    def _get_active(self):
+        key_id, manager = self._active
+        if manager is None:
+            raise ValueError("no active key")
+        return key_id, manager
+
+    def _get_manager(self, key_id, exc_class):
+        try:
+            return self._managers[key_id]
+        except KeyError:
+            raise exc_class("unknown key id: %r" % (key_id,))
+
+    def _split_token(self, token):
+        """Split a token into the manager for its key id, and the rest."""
+        try:
+            if isinstance(token, str):
+                key_id, sep, token = token.partition(".")
+            else:
+                key_id, sep, token = token_to_bytes(token).partition(b".")
+                key_id = key_id.decode("ascii")
+        except (TypeError, ValueError) as e:
+            raise errors.MalformedTokenError(str(e))
+        if not sep:
+            raise errors.MalformedTokenError("token has no key id")
+        return self._get_manager(key_id, errors.InvalidSignatureError), token
+
+
+def _stamp(key_id, token):
+    """Stamp the given key id onto the front of a token."""
+    if isinstance(token, bytes):
+        return key_id.encode("ascii") + b"." + token
+    return key_id + "." + token
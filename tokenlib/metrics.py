@@ -0,0 +1,190 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Instrumentation support for tokenlib.
+
+A TokenManager can be given a metrics sink, to which it will report counts
+and timings for each of its operations:
+
+   * <operation>:  the count and total latency of each call to make_token,
+                   parse_token, get_derived_secret or get_derived_secrets.
+
+   * <operation>.<phase>:  the latency of each phase of that operation;
+                           for parse_token these are "decode" (base64),
+                           "hmac" (signature check) and "payload" (JSON);
+                           for make_token they are "payload" and "hmac";
+                           and for get_derived_secret(s) they are "decode"
+                           and "hkdf".
+
+   * <operation>.rejected.<error class>:  the count of tokens rejected by
+                                          that operation, per error class.
+
+All timings are reported in seconds.
+
+"""
+
+import bisect
+import threading
+from timeit import default_timer
+
+
+class MetricsSink(object):
+    """Base class defining the interface for metrics sinks.
+
+    Subclasses must implement incr() and timing(), and may be called from
+    multiple threads concurrently.
+    """
+
+    def incr(self, name, count=1):
+        """Increment the named counter."""
+        raise NotImplementedError
+
+    def timing(self, name, seconds):
+        """Record a latency measurement for the named timer."""
+        raise NotImplementedError
+
+
+class InMemoryMetrics(MetricsSink):
+    """Metrics sink that aggregates counters and histograms in memory.
+
+    Latencies are recorded into a fixed set of histogram buckets, so memory
+    usage does not grow with the number of measurements.  Use snapshot() to
+    get a copy of the current values.
+
+    Each thread records into its own shard, which is merged with the others
+    when a snapshot is taken, so that threads reporting metrics at the same
+    time do not contend with each other.  The shards of threads that have
+    exited are folded together as new threads start using the sink.
+    """
+
+    #  Upper bounds of the histogram buckets, in seconds.  There is an
+    #  additional final bucket for anything larger than the last bound.
+    BUCKETS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+               1e-3, 2e-3, 5e-3, 1e-2, 1e-1, 1.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _MetricsShard(None)
+
+    def incr(self, name, count=1):
+        shard = self._get_shard()
+        with shard.lock:
+            shard.counters[name] = shard.counters.get(name, 0) + count
+
+    def timing(self, name, seconds):
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        shard = self._get_shard()
+        with shard.lock:
+            histogram = shard.histograms.get(name)
+            if histogram is None:
+                histogram = shard.histograms[name] = \
+                    _new_histogram(len(self.BUCKETS) + 1)
+            histogram["count"] += 1
+            histogram["total"] += seconds
+            histogram["buckets"][index] += 1
+
+    def snapshot(self):
+        """Get a copy of the current counters and histograms.
+
+        The result is a dict with "counters" mapping names to counts, and
+        "histograms" mapping names to dicts with "count", "total" and
+        "buckets" keys.  The bucket counts line up with the BUCKETS bounds.
+        """
+        merged = _MetricsShard(None)
+        with self._lock:
+            for shard in [self._retired] + self._shards:
+                with shard.lock:
+                    merged.merge(shard)
+        return {"counters": merged.counters,
+                "histograms": merged.histograms}
+
+    def reset(self):
+        """Clear all counters and histograms."""
+        with self._lock:
+            for shard in [self._retired] + self._shards:
+                with shard.lock:
+                    shard.counters.clear()
+                    shard.histograms.clear()
+
+    def _get_shard(self):
+        """Get the shard for the current thread, creating it if necessary."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+        shard = self._local.shard = _MetricsShard(threading.current_thread())
+        with self._lock:
+            shards = []
+            for other in self._shards:
+                if other.thread.is_alive():
+                    shards.append(other)
+                else:
+                    with other.lock:
+                        self._retired.merge(other)
+            shards.append(shard)
+            self._shards = shards
+        return shard
+
+
+class _MetricsShard(object):
+    """The counters and histograms recorded by a single thread."""
+
+    __slots__ = ("thread", "lock", "counters", "histograms")
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def merge(self, other):
+        """Add the values from another shard into this one."""
+        for name, count in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + count
+        for name, histogram in other.histograms.items():
+            mine = self.histograms.get(name)
+            if mine is None:
+                mine = self.histograms[name] = \
+                    _new_histogram(len(histogram["buckets"]))
+            mine["count"] += histogram["count"]
+            mine["total"] += histogram["total"]
+            buckets = mine["buckets"]
+            for i, count in enumerate(histogram["buckets"]):
+                buckets[i] += count
+
+
+def _new_histogram(num_buckets):
+    """Get an empty histogram with the given number of buckets."""
+    return {"count": 0, "total": 0.0, "buckets": [0] * num_buckets}
+
+
+class PhaseTimer(object):
+    """Helper for reporting the phases of a single operation to a sink."""
+
+    __slots__ = ("sink", "operation", "start", "last")
+
+    def __init__(self, sink, operation):
+        self.sink = sink
+        self.operation = operation
+        self.start = self.last = default_timer()
+
+    def mark(self, phase):
+        """Record the time since the previous mark against a phase."""
+        now = default_timer()
+        self.sink.timing(self.operation + "." + phase, now - self.last)
+        self.last = now
+
+    def finish(self):
+        """Record the completion of the operation."""
+        self.sink.incr(self.operation)
+        self.sink.timing(self.operation, default_timer() - self.start)
+
+    def reject(self, exc):
+        """Record the failure of the operation with the given error."""
+        self.finish()
+        name = exc.__class__.__name__
+        self.sink.incr(self.operation + ".rejected." + name)
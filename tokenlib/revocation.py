@@ -0,0 +1,196 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+Support for revoking tokens before they expire.
+
+"""
+
+import math
+import time
+import struct
+import hashlib
+import threading
+
+
+DEFAULT_BUCKET_WIDTH = 5 * 60
+DEFAULT_CAPACITY = 10000
+DEFAULT_ERROR_RATE = 0.0001
+
+_MAGIC = b"TLRF\x01"
+_HEADER = struct.Struct(">5sdIBI")
+_BUCKET_HEADER = struct.Struct(">qI")
+
+
+class RevocationFilter(object):
+    """A compact, probabilistic set of revoked tokens.
+
+    This is a Bloom filter of revoked tokens, split into buckets by token
+    expiry time.  Each bucket holds the tokens that expire within a window
+    of bucket_width seconds, and is dropped automatically once all of those
+    tokens have expired, so memory usage is bounded by the number of tokens
+    revoked within their lifetime rather than growing forever.
+
+    Being a Bloom filter, membership tests may give false positives, i.e.
+    report that a token has been revoked when it has not, but will never
+    give false negatives.  Each bucket is sized so that the false positive
+    rate stays below error_rate for up to capacity revoked tokens; beyond
+    that, the rate will gradually increase.
+
+    Tokens are identified by an arbitrary bytestring key, typically their
+    signature, along with their expiry time.  The filter can be serialized
+    with to_bytes() and from_bytes() for shipping between nodes, and the
+    filters from several nodes can be combined with update().
+    """
+
+    def __init__(self, bucket_width=None, capacity=None, error_rate=None):
+        if bucket_width is None:
+            bucket_width = DEFAULT_BUCKET_WIDTH
+        if capacity is None:
+            capacity = DEFAULT_CAPACITY
+        if error_rate is None:
+            error_rate = DEFAULT_ERROR_RATE
+        if bucket_width <= 0 or capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("invalid revocation filter parameters")
+        num_bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        num_bytes = int(math.ceil(num_bits / 8))
+        num_hashes = int(round(num_bytes * 8 / capacity * math.log(2)))
+        self._init(bucket_width, num_bytes, max(1, num_hashes))
+
+    def _init(self, bucket_width, num_bytes, num_hashes):
+        self.bucket_width = float(bucket_width)
+        self.num_bits = num_bytes * 8
+        self.num_hashes = num_hashes
+        self._num_bytes = num_bytes
+        self._lock = threading.Lock()
+        # Maps bucket index to [count of revoked tokens, bit array].
+        self._buckets = {}
+
+    def __len__(self):
+        """The approximate number of revoked tokens in the filter."""
+        return sum(count for (count, _) in self._buckets.values())
+
+    @property
+    def num_buckets(self):
+        return len(self._buckets)
+
+    def revoke(self, key, expires, now=None):
+        """Add the token with the given key and expiry time to the filter."""
+        if now is None:
+            now = time.time()
+        if expires <= now:
+            return
+        index = int(expires // self.bucket_width)
+        positions = self._positions(key)
+        with self._lock:
+            self._purge(now)
+            bucket = self._buckets.get(index)
+            if bucket is None:
+                bucket = self._buckets[index] = [0, bytearray(self._num_bytes)]
+            bucket[0] += 1
+            bits = bucket[1]
+            for pos in positions:
+                bits[pos >> 3] |= 1 << (pos & 7)
+
+    def is_revoked(self, key, expires):
+        """Check whether the token with given key and expiry is revoked.
+
+        This may return false positives, but never false negatives.
+        """
+        bucket = self._buckets.get(int(expires // self.bucket_width))
+        if bucket is None:
+            return False
+        bits = bucket[1]
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def purge(self, now=None):
+        """Drop all buckets whose tokens have all expired."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._purge(now)
+
+    def update(self, other):
+        """Add all the revoked tokens from another filter into this one.
+
+        The other filter must have been created with the same parameters.
+        """
+        if (other.bucket_width, other.num_bits, other.num_hashes) != \
+                (self.bucket_width, self.num_bits, self.num_hashes):
+            raise ValueError("revocation filter parameters do not match")
+        with self._lock:
+            for index, (count, bits) in list(other._buckets.items()):
+                bucket = self._buckets.get(index)
+                if bucket is None:
+                    self._buckets[index] = [count, bytearray(bits)]
+                else:
+                    bucket[0] += count
+                    merged = int.from_bytes(bucket[1], "little") | \
+                        int.from_bytes(bits, "little")
+                    bucket[1] = bytearray(merged.to_bytes(self._num_bytes,
+                                                          "little"))
+
+    def to_bytes(self, now=None):
+        """Serialize the filter into a bytestring.
+
+        Buckets whose tokens have all expired are not included.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._purge(now)
+            buckets = sorted(self._buckets.items())
+            chunks = [_HEADER.pack(_MAGIC, self.bucket_width, self._num_bytes,
+                                   self.num_hashes, len(buckets))]
+            for index, (count, bits) in buckets:
+                chunks.append(_BUCKET_HEADER.pack(index, count))
+                chunks.append(bytes(bits))
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a filter from a bytestring produced by to_bytes().
+
+        This raises ValueError if the data is malformed.
+        """
+        try:
+            magic, bucket_width, num_bytes, num_hashes, num_buckets = \
+                _HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(str(e))
+        if magic != _MAGIC:
+            raise ValueError("not a serialized revocation filter")
+        if not bucket_width > 0 or num_bytes < 1 or num_hashes < 1:
+            raise ValueError("invalid revocation filter parameters")
+        bucket_size = _BUCKET_HEADER.size + num_bytes
+        if len(data) != _HEADER.size + num_buckets * bucket_size:
+            raise ValueError("serialized revocation filter has wrong size")
+        self = cls.__new__(cls)
+        self._init(bucket_width, num_bytes, num_hashes)
+        offset = _HEADER.size
+        for _ in range(num_buckets):
+            index, count = _BUCKET_HEADER.unpack_from(data, offset)
+            offset += _BUCKET_HEADER.size
+            bits = bytearray(data[offset:offset + num_bytes])
+            offset += num_bytes
+            self._buckets[index] = [count, bits]
+        return self
+
+    def _positions(self, key):
+        """Get the bit positions for the given key, via double hashing."""
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def _purge(self, now):
+        """Drop expired buckets.  This must be called with the lock held."""
+        # A bucket holds tokens expiring before (index + 1) * bucket_width.
+        horizon = int(now // self.bucket_width)
+        for index in [i for i in self._buckets if i < horizon]:
+            del self._buckets[index]
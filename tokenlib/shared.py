@@ -0,0 +1,220 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+A token cache shared between processes on the same host.
+
+"""
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: nocover
+    fcntl = None
+
+
+DEFAULT_SIZE = 16384
+
+#  Entries are placed in aligned buckets of this many slots, and a key may
+#  be stored in any slot of its bucket.
+BUCKET_SLOTS = 4
+
+#  The largest derived secret that can be stored, i.e. a sha512 digest.
+MAX_SECRET_SIZE = 64
+
+KEY_SIZE = 16
+
+_MAGIC = b"TLSC\x02"
+_HEADER = struct.Struct("<5sII")
+_HEADER_SIZE = 64
+
+#  Each slot starts with a sequence number, which is odd while the slot is
+#  being written, followed by the entry itself.
+_SEQ = struct.Struct("<I")
+_ENTRY = struct.Struct("<%dsdB%ds" % (KEY_SIZE, MAX_SECRET_SIZE))
+_SLOT_SIZE = 96
+
+_EMPTY_KEY = b"\x00" * KEY_SIZE
+
+
+class SharedTokenCache(object):
+    """A fixed-size cache of token information, shared between processes.
+
+    This is an open-addressed hash table in a memory-mapped file, so that
+    several processes on the same host, e.g. the pre-forked workers of a web
+    server, can share the work of deriving secrets.  Each entry is keyed by
+    a KEY_SIZE-byte hash of a token, and holds its expiry time and derived
+    secret.  Entries are never returned once they have expired;
+    when a bucket is full the entry that expires soonest is evicted.
+
+    Readers take no locks on the entries, only a private lock around the
+    hit and miss counters.  Each slot carries a sequence number that the
+    writer makes odd while updating it, and readers discard any entry whose
+    sequence number was odd or changed while it was being read.  Writers
+    lock just the bucket they are updating, using fcntl range locks between
+    processes and a thread lock within this process.
+
+    Anyone who can write to the file can poison the cache, so it should be
+    created somewhere only the server's own user can access, ideally on a
+    memory-backed filesystem such as /dev/shm.  The file is created with
+    mode 0600 if it does not exist; an existing file is used at its own
+    size, and size must match it if given.
+    """
+
+    def __init__(self, path, size=None):
+        if fcntl is None:  # pragma: nocover
+            raise RuntimeError("shared caches are not supported here")
+        if size is not None and size < BUCKET_SLOTS:
+            raise ValueError("size must be at least %d" % (BUCKET_SLOTS,))
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map, self.size = self._open(size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._num_buckets = self.size // BUCKET_SLOTS
+
+    def _open(self, size):
+        """Map the file into memory, initializing it if it is empty."""
+        file_size = os.fstat(self._fd).st_size
+        if file_size == 0:
+            if size is None:
+                size = DEFAULT_SIZE
+            # Round up to a whole number of buckets.
+            size = -(-size // BUCKET_SLOTS) * BUCKET_SLOTS
+            os.ftruncate(self._fd, _HEADER_SIZE + size * _SLOT_SIZE)
+            mapped = mmap.mmap(self._fd, 0)
+            _HEADER.pack_into(mapped, 0, _MAGIC, size, _SLOT_SIZE)
+            return mapped, size
+        mapped = mmap.mmap(self._fd, 0)
+        try:
+            magic, file_slots, slot_size = _HEADER.unpack_from(mapped)
+            if magic != _MAGIC or slot_size != _SLOT_SIZE:
+                raise ValueError("not a shared token cache: %r" % self.path)
+            if file_size != _HEADER_SIZE + file_slots * _SLOT_SIZE:
+                raise ValueError("shared token cache is truncated")
+            if size is not None and size != file_slots:
+                raise ValueError("shared token cache has size %d, not %d"
+                                 % (file_slots, size))
+        except Exception:
+            mapped.close()
+            raise
+        return mapped, file_slots
+
+    def close(self):
+        """Unmap the cache and close its file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            os.close(self._fd)
+
+    def __len__(self):
+        now = time.time()
+        count = 0
+        for offset in range(_HEADER_SIZE, _HEADER_SIZE +
+                            self.size * _SLOT_SIZE, _SLOT_SIZE):
+            key, expires = _ENTRY.unpack_from(self._map, offset + 4)[:2]
+            if key != _EMPTY_KEY and expires > now:
+                count += 1
+        return count
+
+    def get(self, key, now=None):
+        """Get the entry stored for the given key, or None if not present.
+
+        Entries are returned as (expires, secret) tuples.
+        """
+        if now is None:
+            now = time.time()
+        mapped = self._map
+        offset = self._bucket_offset(key)
+        for offset in range(offset, offset + BUCKET_SLOTS * _SLOT_SIZE,
+                            _SLOT_SIZE):
+            seq = _SEQ.unpack_from(mapped, offset)[0]
+            if seq & 1:
+                continue
+            entry_key, expires, secret_size, secret = \
+                _ENTRY.unpack_from(mapped, offset + 4)
+            if entry_key != key:
+                continue
+            if _SEQ.unpack_from(mapped, offset)[0] != seq:
+                continue
+            if expires <= now:
+                break
+            with self._stats_lock:
+                self.hits += 1
+            return expires, secret[:secret_size]
+        with self._stats_lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, expires, secret, now=None):
+        """Store the derived secret of the token with the given key."""
+        if len(key) != KEY_SIZE or key == _EMPTY_KEY:
+            raise ValueError("invalid shared cache key")
+        if len(secret) > MAX_SECRET_SIZE:
+            raise ValueError("secret is too large for shared cache")
+        if now is None:
+            now = time.time()
+        mapped = self._map
+        bucket = self._bucket_offset(key)
+        length = BUCKET_SLOTS * _SLOT_SIZE
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, bucket)
+            try:
+                # Use the slot already holding this key if there is one,
+                # otherwise the slot whose entry expires soonest.
+                victim = None
+                victim_expires = None
+                for offset in range(bucket, bucket + length, _SLOT_SIZE):
+                    entry_key, entry_expires = \
+                        _ENTRY.unpack_from(mapped, offset + 4)[:2]
+                    if entry_key == key:
+                        victim = offset
+                        break
+                    if victim is None or entry_expires < victim_expires:
+                        victim = offset
+                        victim_expires = entry_expires
+                seq = _SEQ.unpack_from(mapped, victim)[0]
+                _SEQ.pack_into(mapped, victim, (seq + 1) & 0xFFFFFFFF)
+                _ENTRY.pack_into(mapped, victim + 4, key, expires,
+                                 len(secret), secret)
+                _SEQ.pack_into(mapped, victim, (seq + 2) & 0xFFFFFFFF)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, bucket)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        length = self.size * _SLOT_SIZE
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, _HEADER_SIZE)
+            try:
+                mapped = self._map
+                for offset in range(_HEADER_SIZE, _HEADER_SIZE + length,
+                                    _SLOT_SIZE):
+                    seq = _SEQ.unpack_from(mapped, offset)[0]
+                    _SEQ.pack_into(mapped, offset, (seq + 1) & 0xFFFFFFFF)
+                    _ENTRY.pack_into(mapped, offset + 4, _EMPTY_KEY, 0, 0,
+                                     b"")
+                    _SEQ.pack_into(mapped, offset, (seq + 2) & 0xFFFFFFFF)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, _HEADER_SIZE)
+
+    def _bucket_offset(self, key):
+        """Get the file offset of the bucket for the given key."""
+        bucket = int.from_bytes(key[:8], "little") % self._num_buckets
+        return _HEADER_SIZE + bucket * BUCKET_SLOTS * _SLOT_SIZE
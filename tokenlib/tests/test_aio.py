@@ -0,0 +1,220 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import tokenlib
+from tokenlib import errors
+from tokenlib.aio import AsyncTokenManager
+
+
+class CountingTokenManager(tokenlib.TokenManager):
+
+    def __init__(self, *args, **kwds):
+        super(CountingTokenManager, self).__init__(*args, **kwds)
+        self.calls = 0
+
+    def parse_token(self, token, now=None):
+        self.calls += 1
+        return super(CountingTokenManager, self).parse_token(token, now)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+
+    def __init__(self, *args, **kwds):
+        super(CountingExecutor, self).__init__(*args, **kwds)
+        self.submissions = 0
+
+    def submit(self, *args, **kwds):
+        self.submissions += 1
+        return super(CountingExecutor, self).submit(*args, **kwds)
+
+
+class TestAsyncTokenManager(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = CountingExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.loop.close()
+        self.executor.shutdown()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_basic_operations(self):
+        manager = AsyncTokenManager(executor=self.executor, secret="S")
+        sync_manager = tokenlib.TokenManager(secret="S")
+
+        async def check():
+            token = await manager.make_token({"hello": "world"})
+            data = await manager.parse_token(token)
+            self.assertEqual(data["hello"], "world")
+            self.assertEqual(await manager.get_derived_secret(token),
+                             sync_manager.get_derived_secret(token))
+            with self.assertRaises(errors.ExpiredTokenError):
+                await manager.parse_token(token, now=9999999999)
+            with self.assertRaises(errors.MalformedTokenError):
+                await manager.parse_token("@" + token[1:])
+
+        self.run_async(check())
+        self.assertRaises(TypeError, AsyncTokenManager,
+                          sync_manager, secret="S")
+
+    def test_concurrent_requests_are_coalesced_and_batched(self):
+        sync_manager = CountingTokenManager()
+        manager = AsyncTokenManager(sync_manager, executor=self.executor)
+        token = sync_manager.make_token({"hello": "world"})
+        other = sync_manager.make_token({"hello": "other"})
+
+        async def check():
+            tokens = [token] * 50 + [other] * 50
+            results = await asyncio.gather(*[manager.parse_token(t)
+                                             for t in tokens])
+            self.assertEqual([r["hello"] for r in results],
+                             ["world"] * 50 + ["other"] * 50)
+            # Each caller gets its own copy of the data.
+            self.assertTrue(results[0] is not results[1])
+
+        self.run_async(check())
+        self.assertEqual(sync_manager.calls, 2)
+        self.assertEqual(self.executor.submissions, 1)
+        self.assertEqual(manager._inflight, {})
+
+    def test_coalesced_callers_do_not_share_nested_data(self):
+        sync_manager = CountingTokenManager()
+        manager = AsyncTokenManager(sync_manager, executor=self.executor)
+        token = sync_manager.make_token({"scopes": ["read"]})
+
+        async def check():
+            results = await asyncio.gather(*[manager.parse_token(token)
+                                             for _ in range(3)])
+            results[0]["scopes"].append("admin")
+            self.assertEqual(results[1]["scopes"], ["read"])
+            self.assertEqual(results[2]["scopes"], ["read"])
+
+        self.run_async(check())
+        self.assertEqual(sync_manager.calls, 1)
+
+    def test_buffer_tokens_are_coalesced_by_value(self):
+        sync_manager = CountingTokenManager()
+        manager = AsyncTokenManager(sync_manager, executor=self.executor)
+        token = sync_manager.make_token({"hello": "world"}).encode("ascii")
+
+        async def check():
+            tokens = [token, bytearray(token), memoryview(bytearray(token))]
+            results = await asyncio.gather(*[manager.parse_token(t)
+                                             for t in tokens])
+            self.assertEqual([r["hello"] for r in results], ["world"] * 3)
+            secrets = await asyncio.gather(*[manager.get_derived_secret(t)
+                                             for t in tokens])
+            self.assertEqual(len(set(secrets)), 1)
+
+        self.run_async(check())
+        self.assertEqual(sync_manager.calls, 1)
+        self.assertEqual(manager._inflight, {})
+
+    def test_coalesced_callers_share_one_copy_each(self):
+        sync_manager = CountingTokenManager()
+        manager = AsyncTokenManager(sync_manager, executor=self.executor)
+        token = sync_manager.make_token({"scopes": ["read"]})
+
+        async def check():
+            single = await manager.parse_token(token)
+            results = await asyncio.gather(*[manager.parse_token(token)
+                                             for _ in range(3)])
+            return single, results
+
+        single, results = self.run_async(check())
+        self.assertEqual(single["scopes"], ["read"])
+        self.assertEqual(len(set(id(r) for r in results)), 3)
+        self.assertEqual(len(set(id(r["scopes"]) for r in results)), 3)
+        self.assertEqual(sync_manager.calls, 2)
+
+    def test_executor_failures_are_reported_to_every_caller(self):
+        manager = AsyncTokenManager(executor=self.executor, max_batch_size=2)
+        token = manager.manager.make_token({"hello": "world"})
+        self.executor.shutdown()
+
+        async def check():
+            calls = [manager.parse_token(token), manager.parse_token(token),
+                     manager.get_derived_secret(token),
+                     manager.make_token({})]
+            return await asyncio.wait_for(
+                asyncio.gather(*calls, return_exceptions=True), 5)
+
+        results = self.run_async(check())
+        self.assertEqual([type(r) for r in results], [RuntimeError] * 4)
+        self.assertEqual(manager._inflight, {})
+
+    def test_process_pools_are_rejected(self):
+        executor = ProcessPoolExecutor(1)
+        try:
+            self.assertRaises(TypeError, AsyncTokenManager,
+                              executor=executor)
+        finally:
+            executor.shutdown()
+
+    def test_batches_are_bounded_in_size(self):
+        manager = AsyncTokenManager(executor=self.executor, max_batch_size=10)
+
+        async def check():
+            datas = [{"test": i} for i in range(25)]
+            tokens = await asyncio.gather(*[manager.make_token(d)
+                                            for d in datas])
+            self.assertEqual(len(set(tokens)), 25)
+
+        self.run_async(check())
+        self.assertEqual(self.executor.submissions, 3)
+
+    def test_cancelling_one_caller_does_not_affect_others(self):
+        manager = AsyncTokenManager(executor=self.executor)
+        token = manager.manager.make_token({"hello": "world"})
+
+        async def check():
+            task1 = asyncio.ensure_future(manager.parse_token(token))
+            task2 = asyncio.ensure_future(manager.parse_token(token))
+            await asyncio.sleep(0)
+            task1.cancel()
+            data = await task2
+            self.assertEqual(data["hello"], "world")
+            self.assertTrue(task1.cancelled())
+
+        self.run_async(check())
+
+    def test_event_loop_stays_responsive_under_load(self):
+        manager = AsyncTokenManager(executor=self.executor,
+                                    token_format="compact")
+        tokens = manager.manager.make_tokens([{"test": i}
+                                              for i in range(2000)])
+
+        async def measure_max_lag(stop):
+            max_lag = 0
+            while not stop.is_set():
+                start = time.monotonic()
+                await asyncio.sleep(0.001)
+                max_lag = max(max_lag, time.monotonic() - start - 0.001)
+            return max_lag
+
+        async def check():
+            stop = asyncio.Event()
+            ticker = asyncio.ensure_future(measure_max_lag(stop))
+            start = time.monotonic()
+            results = await asyncio.gather(*[manager.parse_token(t)
+                                             for t in tokens])
+            elapsed = time.monotonic() - start
+            stop.set()
+            max_lag = await ticker
+            self.assertEqual(len(results), 2000)
+            return elapsed, max_lag
+
+        elapsed, max_lag = self.run_async(check())
+        # The loop should never be blocked for the duration of the work.
+        # This is a very generous bound to avoid flakiness on slow machines.
+        self.assertTrue(max_lag < max(0.1, elapsed / 2),
+                        "max lag %.3fs during %.3fs" % (max_lag, elapsed))
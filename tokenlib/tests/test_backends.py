@@ -0,0 +1,84 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import hashlib
+import unittest
+
+import tokenlib
+from tokenlib import errors
+from tokenlib.backends import BACKENDS, DEFAULT_BACKEND, get_backend
+from tokenlib.utils import HKDF, HKDF_extract, HKDF_expand, new_keyed_hmac
+
+
+HASHMODS = (hashlib.md5, hashlib.sha1, hashlib.sha256, hashlib.sha512)
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = BACKENDS["python"]
+        self.backends = list(BACKENDS.values())
+
+    def test_get_backend(self):
+        self.assertTrue(get_backend() is DEFAULT_BACKEND)
+        self.assertTrue(get_backend("python") is self.reference)
+        self.assertTrue(get_backend(self.reference) is self.reference)
+        self.assertRaises(ValueError, get_backend, "nonexistent")
+
+    def test_hmac_outputs_are_identical_across_backends(self):
+        for hashmod in HASHMODS:
+            for size in (0, 1, 150, 1000):
+                key = os.urandom(32)
+                data = os.urandom(size)
+                expected = self.reference.hmac_digest(key, data, hashmod)
+                for backend in self.backends:
+                    self.assertEqual(backend.hmac_digest(key, data, hashmod),
+                                     expected)
+                    sign = backend.signer(key, hashmod)
+                    self.assertEqual(sign(data), expected)
+                    # Signers must be re-usable.
+                    self.assertEqual(sign(data), expected)
+
+    def test_hkdf_outputs_are_identical_across_backends(self):
+        for hashmod in HASHMODS:
+            IKM = os.urandom(32)
+            salt = os.urandom(16)
+            expected = HKDF(IKM, salt, b"info", 100, hashmod, self.reference)
+            for backend in self.backends:
+                self.assertEqual(HKDF(IKM, salt, b"info", 100, hashmod,
+                                      backend), expected)
+                PRK = HKDF_extract(new_keyed_hmac(salt, hashmod), IKM,
+                                   hashmod, backend)
+                self.assertEqual(HKDF_expand(new_keyed_hmac(PRK, hashmod),
+                                             b"info", 100, hashmod, backend),
+                                 expected)
+
+    def test_strings_differ_is_identical_across_backends(self):
+        cases = [(b"", b""), (b"", b"a"), (b"b", b"a"), (b"cc", b"a"),
+                 (b"cc", b"aa"), (b"D", b"D"), (b"EEE", b"EEE")]
+        for string1, string2 in cases:
+            expected = self.reference.strings_differ(string1, string2)
+            self.assertEqual(expected, string1 != string2)
+            for backend in self.backends:
+                self.assertEqual(backend.strings_differ(string1, string2),
+                                 expected)
+
+    def test_tokens_are_identical_across_backends(self):
+        data = {"hello": "world", "salt": "abcdef", "expires": 9999999999}
+        for hashmod in HASHMODS:
+            reference = tokenlib.TokenManager(secret="S", hashmod=hashmod,
+                                              backend=self.reference)
+            token = reference.make_token(data)
+            secret = reference.get_derived_secret(token)
+            for backend in self.backends:
+                manager = tokenlib.TokenManager(secret="S", hashmod=hashmod,
+                                                backend=backend)
+                self.assertEqual(manager.make_token(data), token)
+                self.assertEqual(manager.parse_token(token), data)
+                self.assertEqual(manager.get_derived_secret(token), secret)
+                forged = tokenlib.TokenManager(secret="X", hashmod=hashmod,
+                                               backend=backend)
+                with self.assertRaises(errors.InvalidSignatureError):
+                    forged.parse_token(token)
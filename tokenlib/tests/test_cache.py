@@ -0,0 +1,97 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+from tokenlib.cache import (ExpiringLRUCache, ShardedExpiringLRUCache,
+                            MIN_SHARD_SIZE)
+
+
+class TestExpiringLRUCache(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = ExpiringLRUCache(10)
+        self.assertEqual(cache.get("a", now=0), None)
+        cache.set("a", "A", expires=100, now=0)
+        self.assertEqual(cache.get("a", now=0), "A")
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        cache.discard("a")
+        self.assertEqual(cache.get("a", now=0), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_entries_are_never_returned_after_expiry(self):
+        cache = ExpiringLRUCache(10)
+        cache.set("a", "A", expires=100, now=0)
+        self.assertEqual(cache.get("a", now=99), "A")
+        self.assertEqual(cache.get("a", now=100), None)
+        self.assertEqual(len(cache), 0)
+        # Entries that are already expired are not stored at all.
+        cache.set("b", "B", expires=100, now=200)
+        self.assertEqual(len(cache), 0)
+
+    def test_expired_entries_are_purged_on_write(self):
+        cache = ExpiringLRUCache(10)
+        cache.set("a", "A", expires=10, now=0)
+        cache.set("b", "B", expires=20, now=0)
+        cache.set("c", "C", expires=30, now=15)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b", now=15), "B")
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ExpiringLRUCache(2)
+        cache.set("a", "A", expires=100, now=0)
+        cache.set("b", "B", expires=100, now=0)
+        cache.get("a", now=0)
+        cache.set("c", "C", expires=100, now=0)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a", now=0), "A")
+        self.assertEqual(cache.get("b", now=0), None)
+        self.assertEqual(cache.get("c", now=0), "C")
+
+    def test_overwriting_entries_does_not_grow_without_bound(self):
+        cache = ExpiringLRUCache(2)
+        for i in range(100):
+            cache.set("a", i, expires=100 + i, now=0)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(len(cache._expiry_heap) <= 4)
+        self.assertEqual(cache.get("a", now=150), 99)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+
+class TestShardedExpiringLRUCache(unittest.TestCase):
+
+    def test_small_caches_are_not_sharded(self):
+        cache = ShardedExpiringLRUCache(2, shards=16)
+        self.assertEqual(len(cache._shards), 1)
+        cache.set("a", "A", expires=100, now=0)
+        cache.set("b", "B", expires=100, now=0)
+        cache.get("a", now=0)
+        cache.set("c", "C", expires=100, now=0)
+        self.assertEqual(cache.get("b", now=0), None)
+        self.assertEqual(cache.get("a", now=0), "A")
+
+    def test_entries_are_spread_across_shards(self):
+        cache = ShardedExpiringLRUCache(MIN_SHARD_SIZE * 4, shards=16)
+        self.assertEqual(len(cache._shards), 4)
+        for i in range(100):
+            cache.set(str(i), i, expires=100, now=0)
+        self.assertEqual(len(cache), 100)
+        self.assertTrue(all(len(shard) for shard in cache._shards))
+        self.assertEqual(cache.get("42", now=0), 42)
+        self.assertEqual(cache.get("42", now=100), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.discard("7")
+        self.assertEqual(len(cache), 98)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+        self.assertRaises(ValueError, ShardedExpiringLRUCache, 0)
+
+    def test_shard_sizes_add_up_to_max_size(self):
+        for max_size in (1000, MIN_SHARD_SIZE * 4 + 3, MIN_SHARD_SIZE * 16):
+            cache = ShardedExpiringLRUCache(max_size, shards=16)
+            sizes = [shard.max_size for shard in cache._shards]
+            self.assertEqual(sum(sizes), max_size)
+            self.assertTrue(max(sizes) - min(sizes) <= 1)
@@ -0,0 +1,82 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import io
+import os
+import json
+import tempfile
+import unittest
+
+import tokenlib
+from tokenlib.cli import main
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def run_cli(self, args, lines):
+        stdin = io.StringIO(u"".join(line + u"\n" for line in lines))
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = main(args, stdin=stdin, stdout=stdout, stderr=stderr)
+        self.assertEqual(status, 0)
+        records = [json.loads(line) for line in stdout.getvalue().split("\n")
+                   if line]
+        return records, stderr.getvalue()
+
+    def test_mint_verify_and_derive(self):
+        datas = [json.dumps({"uid": i}) for i in range(10)]
+        records, summary = self.run_cli(["mint", "--secret", "S",
+                                         "--token-format", "compact"], datas)
+        self.assertTrue(summary.startswith("mint: 10 records"))
+        tokens = [r["token"] for r in records]
+        manager = tokenlib.TokenManager(secret="S")
+        for i, token in enumerate(tokens):
+            self.assertEqual(manager.parse_token(token)["uid"], i)
+        lines = [tokens[0], json.dumps(tokens[1]),
+                 json.dumps({"token": tokens[2]})]
+        records, _ = self.run_cli(["verify", "--secret", "S"], lines)
+        self.assertEqual([r["data"]["uid"] for r in records], [0, 1, 2])
+        records, _ = self.run_cli(["derive-secret", "--secret", "S"], lines)
+        self.assertEqual([r["secret"] for r in records],
+                         [manager.get_derived_secret(t) for t in tokens[:3]])
+
+    def test_errors_are_reported_per_record(self):
+        good = tokenlib.make_token({"uid": 1}, secret="S")
+        bad = tokenlib.make_token({"uid": 1}, secret="X")
+        expired = tokenlib.make_token({"uid": 1, "expires": 1}, secret="S")
+        lines = [good, bad, expired, "{}", "", bad]
+        records, summary = self.run_cli(["verify", "--secret", "S"], lines)
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]["data"]["uid"], 1)
+        self.assertEqual([r.get("error") for r in records[1:]],
+                         ["InvalidSignatureError", "ExpiredTokenError",
+                          "ValueError", "InvalidSignatureError"])
+        self.assertTrue("  InvalidSignatureError: 2\n" in summary)
+        self.assertTrue("  ExpiredTokenError: 1\n" in summary)
+        records, _ = self.run_cli(["mint", "--secret", "S"], ["[1]", "{"])
+        self.assertEqual([r["error"] for r in records],
+                         ["ValueError", "JSONDecodeError"])
+
+    def test_process_pool_preserves_order(self):
+        datas = [json.dumps({"uid": i}) for i in range(50)]
+        with tempfile.NamedTemporaryFile("w", delete=False) as f:
+            f.write("\n".join(datas))
+        try:
+            records, _ = self.run_cli(["mint", "--secret", "S", "-i", f.name,
+                                       "--workers", "2", "--chunk-size", "7"],
+                                      [])
+        finally:
+            os.unlink(f.name)
+        manager = tokenlib.TokenManager(secret="S")
+        uids = [manager.parse_token(r["token"])["uid"] for r in records]
+        self.assertEqual(uids, list(range(50)))
+
+    def test_secret_is_required(self):
+        environ = os.environ.pop("TOKENLIB_SECRET", None)
+        try:
+            with self.assertRaises(SystemExit):
+                main(["mint"], stderr=io.StringIO())
+        finally:
+            if environ is not None:
+                os.environ["TOKENLIB_SECRET"] = environ
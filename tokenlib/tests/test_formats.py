@@ -0,0 +1,176 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import zlib
+import unittest
+
+from tokenlib.formats import (FORMAT_JSON, FORMAT_COMPACT, COMPACT_VERSION,
+                              COMPACT_HEADER_SIZE, FLAG_COMPRESSED,
+                              encode_payload,
+                              decode_payload, read_compact_header,
+                              TokenData)
+
+
+class _RacingTokenData(TokenData):
+    """TokenData that is decoded by "another thread" mid-way through."""
+
+    __slots__ = ("raced",)
+
+    def __init__(self, payload):
+        self.raced = False
+        super(_RacingTokenData, self).__init__(payload)
+
+    def __getattribute__(self, name):
+        if name == "_payload" and not object.__getattribute__(self, "raced"):
+            self.raced = True
+            TokenData._decode(self)
+        return object.__getattribute__(self, name)
+
+
+class TestFormats(unittest.TestCase):
+
+    def test_payloads_roundtrip_in_all_formats(self):
+        data = {"uid": 42, "node": "https://example.com",
+                "expires": 1329875384.073159, "salt": "1c033f"}
+        for payload_format in (FORMAT_JSON, FORMAT_COMPACT):
+            payload = encode_payload(data, payload_format)
+            self.assertEqual(decode_payload(payload), data)
+
+    def test_compact_payloads_are_smaller(self):
+        data = {"uid": 42, "expires": 1329875384.073159, "salt": "1c033f"}
+        json_payload = encode_payload(data, FORMAT_JSON)
+        compact_payload = encode_payload(data, FORMAT_COMPACT)
+        self.assertEqual(json_payload[:1], b"{")
+        self.assertEqual(compact_payload[:1], COMPACT_VERSION)
+        self.assertTrue(len(compact_payload) < len(json_payload) / 2)
+        # With no extra fields, the payload is just the header.
+        data = {"expires": 1329875384.073159, "salt": "1c033f"}
+        compact_payload = encode_payload(data, FORMAT_COMPACT)
+        self.assertEqual(len(compact_payload), COMPACT_HEADER_SIZE)
+        self.assertEqual(decode_payload(compact_payload), data)
+
+    def test_compact_header_can_be_read_without_decoding_body(self):
+        data = {"uid": 42, "expires": 1234.5, "salt": "abcdef"}
+        payload = encode_payload(data, FORMAT_COMPACT)
+        self.assertEqual(read_compact_header(payload), (0, 1234.5, "abcdef"))
+        # Corrupting the body does not affect reading the header.
+        payload = payload[:COMPACT_HEADER_SIZE] + b"NOTJSON"
+        self.assertEqual(read_compact_header(payload), (0, 1234.5, "abcdef"))
+        self.assertRaises(ValueError, decode_payload, payload)
+
+    def test_compact_format_preserves_custom_salts(self):
+        for salt in ("ABCDEF", "salty", "", 42, "0123456789"):
+            data = {"expires": 1234.5, "salt": salt}
+            payload = encode_payload(data, FORMAT_COMPACT)
+            self.assertEqual(decode_payload(payload), data)
+
+    def test_malformed_payloads(self):
+        self.assertRaises(ValueError, encode_payload, {}, "unknown")
+        self.assertRaises(ValueError, encode_payload, {"salt": "abcdef"},
+                          FORMAT_COMPACT)
+        self.assertRaises(ValueError, decode_payload, COMPACT_VERSION)
+        self.assertRaises(ValueError, read_compact_header, b"\x03" * 20)
+        body = json.dumps([1, 2]).encode("ascii")
+        payload = encode_payload({"expires": 1, "salt": "abcdef"},
+                                 FORMAT_COMPACT)
+        self.assertRaises(ValueError, decode_payload, payload + body)
+
+    def test_lazy_decoding_of_compact_payloads(self):
+        data = {"uid": 42, "expires": 1234.5, "salt": "abcdef"}
+        payload = encode_payload(data, FORMAT_COMPACT)
+        self.assertEqual(decode_payload(payload, lazy=True), data)
+        lazy = decode_payload(payload, lazy=True)
+        self.assertTrue(isinstance(lazy, TokenData))
+        self.assertEqual(lazy.expires, 1234.5)
+        self.assertEqual(lazy["salt"], "abcdef")
+        self.assertTrue(lazy._data is None)
+        self.assertEqual(lazy["uid"], 42)
+        self.assertEqual(len(lazy), 3)
+        self.assertEqual(dict(lazy), data)
+        # JSON payloads are always decoded in full.
+        payload = encode_payload(data, FORMAT_JSON)
+        self.assertEqual(type(decode_payload(payload, lazy=True)), dict)
+
+    def test_lazy_decoding_of_malformed_body(self):
+        data = {"uid": 42, "expires": 1234.5, "salt": "abcdef"}
+        payload = encode_payload(data, FORMAT_COMPACT)
+        payload = payload[:COMPACT_HEADER_SIZE] + b"NOTJSON"
+        lazy = decode_payload(payload, lazy=True)
+        self.assertEqual(lazy["expires"], 1234.5)
+        self.assertRaises(ValueError, lazy.__getitem__, "uid")
+        data = {"expires": 1234.5, "salt": "custom"}
+        payload = encode_payload(data, FORMAT_COMPACT)
+        self.assertEqual(decode_payload(payload, lazy=True).salt, "custom")
+
+    def test_lazy_decoding_is_safe_across_threads(self):
+        data = {"uid": 42, "expires": 1234.5, "salt": "abcdef"}
+        lazy = _RacingTokenData(encode_payload(data, FORMAT_COMPACT))
+        self.assertEqual(lazy["uid"], 42)
+        self.assertTrue(lazy.raced)
+        self.assertEqual(dict(lazy), data)
+
+    def test_lazy_decoding_of_json_payloads(self):
+        data = {"uid": 42, "salt": "abcdef", "expires": 1234.5}
+        lazy = TokenData(encode_payload(data, FORMAT_JSON))
+        self.assertEqual(lazy.expires, 1234.5)
+        self.assertEqual(lazy.salt, "abcdef")
+        self.assertTrue(lazy._data is None)
+        self.assertEqual(lazy, data)
+        self.assertEqual(lazy._data, data)
+        # Integer expiry times keep their type.
+        data["expires"] = 1234
+        self.assertEqual(type(TokenData(json.dumps(data).encode()).expires),
+                         int)
+        # Fields found elsewhere in the payload are decoded up front.
+        for data in ({"salt": "abcdef", "expires": 1234.5, "uid": 42},
+                     {"expires": 1234.5, "salt": "custom salt"}):
+            lazy = TokenData(encode_payload(data, FORMAT_JSON))
+            self.assertFalse(lazy._data is None)
+            self.assertEqual(lazy.expires, data["expires"])
+            self.assertEqual(lazy.salt, data["salt"])
+            self.assertEqual(lazy, data)
+        # Only the top-level fields are ever found at the tail.
+        data = {"uid": {"salt": "abcdef", "expires": 1234.5},
+                "salt": "fedcba", "expires": 2}
+        lazy = TokenData(encode_payload(data, FORMAT_JSON))
+        self.assertEqual((lazy.salt, lazy.expires), ("fedcba", 2))
+        self.assertRaises(ValueError, TokenData, b'{"uid": 42}')
+        self.assertRaises(ValueError, TokenData, b'[1, 2]')
+
+    def test_compression_of_large_compact_payloads(self):
+        data = {"expires": 1234.5, "salt": "custom salt",
+                "scopes": ["https://identity.mozilla.com/apps/%d" % i
+                           for i in range(50)]}
+        plain = encode_payload(data, FORMAT_COMPACT)
+        for threshold in (None, len(plain)):
+            payload = encode_payload(data, FORMAT_COMPACT, threshold)
+            self.assertEqual(payload, plain)
+        payload = encode_payload(data, FORMAT_COMPACT, 100)
+        self.assertTrue(len(payload) < len(plain) / 2)
+        self.assertTrue(read_compact_header(payload)[0] & FLAG_COMPRESSED)
+        self.assertEqual(decode_payload(payload), data)
+        lazy = decode_payload(payload, lazy=True)
+        self.assertEqual(lazy.salt, "custom salt")
+        self.assertEqual(lazy["scopes"], data["scopes"])
+        # Bodies that don't shrink are left alone.
+        small = {"expires": 1234.5, "salt": "abcdef", "uid": 42}
+        self.assertEqual(encode_payload(small, FORMAT_COMPACT, 0),
+                         encode_payload(small, FORMAT_COMPACT))
+        self.assertRaises(ValueError, encode_payload, small, FORMAT_JSON, 0)
+
+    def test_decompression_is_bounded(self):
+        data = {"expires": 1234.5, "salt": "abcdef", "pad": "x" * 10000}
+        payload = encode_payload(data, FORMAT_COMPACT, 0)
+        self.assertEqual(decode_payload(payload, max_decompressed_size=10015),
+                         data)
+        self.assertRaises(ValueError, decode_payload, payload,
+                          max_decompressed_size=10000)
+        lazy = decode_payload(payload, lazy=True, max_decompressed_size=100)
+        self.assertEqual(lazy.expires, 1234.5)
+        self.assertRaises(ValueError, lazy.__getitem__, "pad")
+        header = payload[:COMPACT_HEADER_SIZE]
+        self.assertRaises(ValueError, decode_payload, header + b"NOTZLIB")
+        truncated = header + zlib.compress(b'{"a":1}')[:-4]
+        self.assertRaises(ValueError, decode_payload, truncated)
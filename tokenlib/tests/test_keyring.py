@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+import tokenlib
+from tokenlib import errors
+from tokenlib.keyring import KeyringTokenManager
+
+
+class TestKeyring(unittest.TestCase):
+
+    def test_tokens_are_stamped_with_the_active_key_id(self):
+        keyring = KeyringTokenManager({"k1": "one"})
+        self.assertEqual(keyring.active_key, "k1")
+        token = keyring.make_token({"hello": "world"})
+        self.assertTrue(token.startswith("k1."))
+        self.assertEqual(keyring.parse_token(token)["hello"], "world")
+        # The rest of the token is an ordinary token for that key.
+        manager = tokenlib.TokenManager(secret="one")
+        self.assertEqual(manager.parse_token(token[3:])["hello"], "world")
+        self.assertEqual(keyring.get_derived_secret(token),
+                         manager.get_derived_secret(token[3:]))
+
+    def test_key_rotation(self):
+        keyring = KeyringTokenManager([("k1", "one"), ("k2", "two")],
+                                      active_key="k1", timeout=60)
+        self.assertEqual(keyring.key_ids, ["k1", "k2"])
+        self.assertEqual(keyring.get_manager("k1").timeout, 60)
+        token1 = keyring.make_token({"test": 1})
+        secret1 = keyring.get_derived_secret(token1)
+        keyring.add_key("k3", "three", activate=True)
+        token3 = keyring.make_token({"test": 3})
+        self.assertTrue(token3.startswith("k3."))
+        # Tokens signed with older keys are still valid.
+        self.assertEqual(keyring.parse_token(token1)["test"], 1)
+        self.assertEqual(keyring.get_derived_secret(token1), secret1)
+        self.assertNotEqual(keyring.get_derived_secret(token3), secret1)
+        # Until the key is retired.
+        keyring.retire_key("k1")
+        with self.assertRaises(errors.InvalidSignatureError):
+            keyring.parse_token(token1)
+        with self.assertRaises(errors.InvalidSignatureError):
+            keyring.get_derived_secret(token1)
+        self.assertEqual(keyring.parse_token(token3)["test"], 3)
+
+    def test_key_id_cannot_be_swapped(self):
+        keyring = KeyringTokenManager({"k1": "one", "k2": "two"},
+                                      active_key="k1")
+        token = keyring.make_token({"test": 1})
+        with self.assertRaises(errors.InvalidSignatureError):
+            keyring.parse_token("k2" + token[2:])
+
+    def test_malformed_tokens(self):
+        keyring = KeyringTokenManager({"k1": "one"})
+        token = keyring.make_token({"test": 1})
+        with self.assertRaises(errors.MalformedTokenError):
+            keyring.parse_token(token[3:])
+        with self.assertRaises(errors.MalformedTokenError):
+            keyring.parse_token(None)
+        with self.assertRaises(errors.InvalidSignatureError):
+            keyring.parse_token("nope." + token[3:])
+        results = keyring.parse_tokens([token, token[3:]])
+        self.assertEqual(results[0]["test"], 1)
+        self.assertTrue(isinstance(results[1], errors.MalformedTokenError))
+        # Unusable data in a correctly-signed token doesn't abort the batch,
+        # and large batches can be spread over a thread pool.
+        unusable = keyring.make_token({"test": 2, "expires": "soon"})
+        count = tokenlib.BATCH_CHUNK_SIZE + 1
+        results = keyring.parse_tokens([unusable] + [token] * count,
+                                       max_workers=2)
+        self.assertTrue(isinstance(results[0], errors.MalformedTokenError))
+        self.assertEqual([r["test"] for r in results[1:]], [1] * count)
+
+    def test_keyring_management_errors(self):
+        keyring = KeyringTokenManager()
+        self.assertRaises(ValueError, keyring.make_token, {})
+        self.assertRaises(ValueError, keyring.add_key, "bad.id", "secret")
+        self.assertRaises(ValueError, keyring.add_key, "", "secret")
+        self.assertRaises(ValueError, keyring.add_key, "k2\n", "secret")
+        keyring.add_key("k1", "one")
+        self.assertRaises(ValueError, keyring.add_key, "k1", "again")
+        self.assertRaises(KeyError, keyring.activate_key, "k2")
+        self.assertRaises(KeyError, keyring.get_manager, "k2")
+        keyring.activate_key("k1")
+        self.assertRaises(ValueError, keyring.retire_key, "k1")
+        keyring = KeyringTokenManager({"k1": "one", "k2": "two"})
+        self.assertEqual(keyring.active_key, None)
+        self.assertRaises(ValueError, keyring.make_token, {})
+
+    def test_batch_minting(self):
+        keyring = KeyringTokenManager({"k1": "one"})
+        tokens = keyring.make_tokens([{"test": 1}, {"test": object()}])
+        self.assertEqual(keyring.parse_token(tokens[0])["test"], 1)
+        self.assertTrue(isinstance(tokens[1], TypeError))
+
+    def test_tokens_as_bytes(self):
+        keyring = KeyringTokenManager({"k1": "one"}, return_bytes=True)
+        token = keyring.make_token({"test": 1})
+        self.assertTrue(token.startswith(b"k1."))
+        self.assertEqual(keyring.parse_token(token)["test"], 1)
+        self.assertEqual(keyring.parse_token(memoryview(token))["test"], 1)
+        self.assertEqual(keyring.get_derived_secret(bytearray(token)),
+                         keyring.get_derived_secret(token))
+        with self.assertRaises(errors.MalformedTokenError):
+            keyring.parse_token(b"\xff." + token[3:])
+
+    def test_multiple_derived_secrets(self):
+        keyring = KeyringTokenManager({"k1": "one"})
+        token = keyring.make_token({"test": 1})
+        secrets = keyring.get_derived_secrets(token, ["", "signing"])
+        self.assertEqual(secrets[""], keyring.get_derived_secret(token))
+        self.assertEqual(secrets["signing"],
+                         keyring.get_manager("k1").get_derived_secrets(
+                             token[3:], ["signing"])["signing"])
@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import unittest
+
+import tokenlib
+from tokenlib.metrics import InMemoryMetrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_in_memory_metrics(self):
+        metrics = InMemoryMetrics()
+        metrics.incr("a")
+        metrics.incr("a", 2)
+        metrics.timing("t", 0.0000015)
+        metrics.timing("t", 5.0)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"a": 3})
+        histogram = snapshot["histograms"]["t"]
+        self.assertEqual(histogram["count"], 2)
+        self.assertAlmostEqual(histogram["total"], 5.0000015)
+        self.assertEqual(histogram["buckets"][1], 1)
+        self.assertEqual(histogram["buckets"][-1], 1)
+        self.assertEqual(sum(histogram["buckets"]), 2)
+        # Snapshots are not affected by later updates.
+        metrics.incr("a")
+        self.assertEqual(snapshot["counters"], {"a": 3})
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(),
+                         {"counters": {}, "histograms": {}})
+
+    def test_token_manager_reports_operations_and_phases(self):
+        metrics = InMemoryMetrics()
+        manager = tokenlib.TokenManager(metrics=metrics)
+        token = manager.make_token({"hello": "world"})
+        manager.parse_token(token)
+        manager.get_derived_secret(token)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {
+            "make_token": 1,
+            "parse_token": 1,
+            "get_derived_secret": 1,
+        })
+        self.assertEqual(sorted(snapshot["histograms"]), [
+            "get_derived_secret",
+            "get_derived_secret.decode",
+            "get_derived_secret.hkdf",
+            "make_token",
+            "make_token.hmac",
+            "make_token.payload",
+            "parse_token",
+            "parse_token.decode",
+            "parse_token.hmac",
+            "parse_token.payload",
+        ])
+
+    def test_token_manager_reports_rejections(self):
+        metrics = InMemoryMetrics()
+        manager = tokenlib.TokenManager(metrics=metrics)
+        forged = tokenlib.make_token({"hello": "world"}, secret="X")
+        expired = manager.make_token({"hello": "world", "expires": 1})
+        results = manager.parse_tokens([forged, "@" + forged[1:], expired])
+        self.assertTrue(all(isinstance(r, tokenlib.errors.Error)
+                            for r in results))
+        self.assertRaises(ValueError, manager.get_derived_secret,
+                          tokenlib.utils.encode_token_bytes(b"X" * 50))
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["parse_token"], 3)
+        self.assertEqual(counters["parse_token.rejected.InvalidSignatureError"],
+                         1)
+        self.assertEqual(counters["parse_token.rejected.MalformedTokenError"],
+                         1)
+        self.assertEqual(counters["parse_token.rejected.ExpiredTokenError"], 1)
+        self.assertEqual(
+            counters["get_derived_secret.rejected.MalformedTokenError"], 1)
+        self.assertEqual(counters["make_token"], 1)
+
+    def test_no_metrics_by_default(self):
+        manager = tokenlib.TokenManager()
+        self.assertEqual(manager.metrics, None)
+
+    def test_threads_record_into_separate_shards(self):
+        metrics = InMemoryMetrics()
+
+        def report():
+            for _ in range(1000):
+                metrics.incr("a")
+                metrics.timing("t", 0.001)
+
+        for _ in range(3):
+            threads = [threading.Thread(target=report) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"a": 12000})
+        self.assertEqual(snapshot["histograms"]["t"]["count"], 12000)
+        self.assertEqual(sum(snapshot["histograms"]["t"]["buckets"]), 12000)
+        # Shards of exited threads are folded away as new threads arrive.
+        self.assertTrue(len(metrics._shards) <= 4)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(),
+                         {"counters": {}, "histograms": {}})
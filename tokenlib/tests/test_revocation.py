@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import unittest
+
+from tokenlib.revocation import RevocationFilter, _HEADER, _MAGIC
+
+
+class TestRevocationFilter(unittest.TestCase):
+
+    def test_revoked_keys_are_found(self):
+        rf = RevocationFilter(bucket_width=100, capacity=1000)
+        keys = [os.urandom(32) for _ in range(1000)]
+        for key in keys:
+            rf.revoke(key, expires=150, now=0)
+        self.assertEqual(len(rf), 1000)
+        for key in keys:
+            self.assertTrue(rf.is_revoked(key, 150))
+        # The expiry time selects the bucket to check.
+        self.assertFalse(rf.is_revoked(keys[0], 250))
+        # Within capacity, false positives are rare.
+        false_positives = sum(rf.is_revoked(os.urandom(32), 150)
+                              for _ in range(10000))
+        self.assertTrue(false_positives < 10)
+
+    def test_buckets_are_dropped_once_expired(self):
+        rf = RevocationFilter(bucket_width=100)
+        rf.revoke(b"one", expires=150, now=0)
+        rf.revoke(b"two", expires=199, now=0)
+        rf.revoke(b"three", expires=250, now=0)
+        self.assertEqual(rf.num_buckets, 2)
+        rf.purge(now=199)
+        self.assertEqual(rf.num_buckets, 2)
+        rf.purge(now=200)
+        self.assertEqual(rf.num_buckets, 1)
+        self.assertFalse(rf.is_revoked(b"one", 150))
+        self.assertTrue(rf.is_revoked(b"three", 250))
+        # Revoking an already-expired token does nothing.
+        rf.revoke(b"four", expires=250, now=300)
+        self.assertEqual(len(rf), 1)
+        # Revoking also purges expired buckets.
+        rf.revoke(b"five", expires=450, now=300)
+        self.assertEqual(rf.num_buckets, 1)
+
+    def test_serialization(self):
+        rf = RevocationFilter(bucket_width=100, capacity=100)
+        rf.revoke(b"one", expires=150, now=0)
+        rf.revoke(b"two", expires=250, now=0)
+        data = rf.to_bytes(now=0)
+        rf2 = RevocationFilter.from_bytes(data)
+        self.assertEqual(rf2.bucket_width, 100)
+        self.assertEqual(rf2.num_buckets, 2)
+        self.assertEqual(len(rf2), 2)
+        self.assertTrue(rf2.is_revoked(b"one", 150))
+        self.assertTrue(rf2.is_revoked(b"two", 250))
+        self.assertFalse(rf2.is_revoked(b"three", 250))
+        self.assertEqual(rf2.to_bytes(now=0), data)
+        # Expired buckets are not shipped.
+        self.assertEqual(RevocationFilter.from_bytes(
+            rf.to_bytes(now=200)).num_buckets, 1)
+        self.assertRaises(ValueError, RevocationFilter.from_bytes, b"")
+        self.assertRaises(ValueError, RevocationFilter.from_bytes, data[:-1])
+        self.assertRaises(ValueError, RevocationFilter.from_bytes,
+                          b"X" + data[1:])
+        # Headers with unusable parameters are rejected, not divided by.
+        for width, num_bytes, num_hashes in ((100, 0, 1), (100, 8, 0),
+                                             (0, 8, 1), (float("nan"), 8, 1)):
+            bad = _HEADER.pack(_MAGIC, width, num_bytes, num_hashes, 0)
+            self.assertRaises(ValueError, RevocationFilter.from_bytes, bad)
+
+    def test_merging_filters_from_several_nodes(self):
+        rf1 = RevocationFilter(bucket_width=100)
+        rf2 = RevocationFilter(bucket_width=100)
+        rf1.revoke(b"one", expires=150, now=0)
+        rf2.revoke(b"two", expires=150, now=0)
+        rf2.revoke(b"three", expires=250, now=0)
+        rf1.update(RevocationFilter.from_bytes(rf2.to_bytes(now=0)))
+        for key, expires in ((b"one", 150), (b"two", 150), (b"three", 250)):
+            self.assertTrue(rf1.is_revoked(key, expires))
+        self.assertEqual(len(rf1), 3)
+        self.assertRaises(ValueError, rf1.update,
+                          RevocationFilter(bucket_width=50))
+
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, RevocationFilter, bucket_width=0)
+        self.assertRaises(ValueError, RevocationFilter, capacity=0)
+        self.assertRaises(ValueError, RevocationFilter, error_rate=1)
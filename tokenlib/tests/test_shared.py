@@ -0,0 +1,184 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+import hashlib
+import tempfile
+import unittest
+import threading
+import multiprocessing
+
+import tokenlib
+from tokenlib import errors
+from tokenlib.shared import SharedTokenCache, BUCKET_SLOTS
+
+
+def _key(i):
+    return hashlib.md5(str(i).encode("ascii")).digest()
+
+
+def _secret(key):
+    return hashlib.sha256(key).digest()
+
+
+def _parse_and_derive(path, tokens):
+    """Worker for the multi-process tests; returns its results and hits."""
+    cache = SharedTokenCache(path)
+    manager = tokenlib.TokenManager(secret="shared", shared_cache=cache)
+    results = [(manager.parse_token(token)["uid"],
+                manager.get_derived_secret(token)) for token in tokens]
+    return results, cache.hits
+
+
+def _hammer(path, worker, rounds):
+    """Worker that races with others to read and write the same keys."""
+    cache = SharedTokenCache(path)
+    expires = time.time() + 60
+    torn = 0
+    for i in range(rounds):
+        key = _key((i + worker) % 40)
+        cache.set(key, expires, _secret(key))
+        entry = cache.get(_key(i % 40))
+        if entry is not None and entry[1] != _secret(_key(i % 40)):
+            torn += 1
+    return torn
+
+
+class TestSharedTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "tokens.cache")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_entries_are_replaced_and_expire(self):
+        cache = SharedTokenCache(self.path, size=64)
+        self.assertEqual(cache.get(_key(1)), None)
+        cache.set(_key(1), 20, b"secret", now=10)
+        self.assertEqual(cache.get(_key(1), now=10), (20, b"secret"))
+        self.assertEqual(cache.get(_key(1), now=20), None)
+        cache.set(_key(1), 30, b"other", now=25)
+        self.assertEqual(cache.get(_key(1), now=25), (30, b"other"))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        cache.clear()
+        self.assertEqual(cache.get(_key(1), now=25), None)
+        self.assertRaises(ValueError, cache.set, b"short", 30, b"secret")
+        self.assertRaises(ValueError, cache.set, _key(1), 30, b"X" * 65)
+        cache.close()
+
+    def test_full_buckets_evict_the_soonest_expiry(self):
+        cache = SharedTokenCache(self.path, size=BUCKET_SLOTS)
+        now = time.time()
+        for i in range(BUCKET_SLOTS + 1):
+            cache.set(_key(i), now + 100 - i, b"secret")
+        self.assertEqual(len(cache), BUCKET_SLOTS)
+        self.assertEqual(cache.get(_key(BUCKET_SLOTS - 1)), None)
+        self.assertFalse(cache.get(_key(BUCKET_SLOTS)) is None)
+        cache.close()
+
+    def test_cache_file_is_shared_and_checked(self):
+        cache = SharedTokenCache(self.path, size=64)
+        cache.set(_key(1), time.time() + 100, b"secret")
+        other = SharedTokenCache(self.path)
+        self.assertEqual(other.size, 64)
+        self.assertEqual(other.get(_key(1))[1], b"secret")
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertRaises(ValueError, SharedTokenCache, self.path, size=128)
+        with open(self.path, "r+b") as f:
+            f.write(b"XXXX")
+        self.assertRaises(ValueError, SharedTokenCache, self.path)
+        cache.close()
+        other.close()
+
+    def test_counters_are_exact_across_threads(self):
+        cache = SharedTokenCache(self.path, size=64)
+        cache.set(_key(1), time.time() + 100, b"secret")
+
+        def run():
+            for i in range(2000):
+                cache.get(_key(i % 2))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((cache.hits, cache.misses), (4000, 4000))
+        cache.close()
+
+    def test_token_manager_uses_shared_cache(self):
+        cache = SharedTokenCache(self.path, size=64)
+        manager = tokenlib.TokenManager(secret="shared", shared_cache=cache)
+        other = tokenlib.TokenManager(secret="shared", shared_cache=cache,
+                                      secret_cache_size=10)
+        token = manager.make_token({"uid": 42})
+        secret = manager.get_derived_secret(token)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(other.get_derived_secret(token), secret)
+        self.assertEqual(cache.hits, 1)
+        # Parsing always verifies the token in full.
+        self.assertEqual(other.parse_token(token)["uid"], 42)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        forged = token[:-4] + "AAAA"
+        self.assertRaises(errors.InvalidSignatureError,
+                          other.parse_token, forged)
+        # Secrets for other master secrets are never shared.
+        stranger = tokenlib.TokenManager(secret="other", shared_cache=cache)
+        self.assertRaises(errors.InvalidSignatureError,
+                          stranger.parse_token, token)
+        self.assertNotEqual(stranger.get_derived_secret(token), secret)
+        cache.close()
+
+    def test_forged_tokens_do_not_outlive_genuine_ones(self):
+        cache = SharedTokenCache(self.path, size=BUCKET_SLOTS)
+        manager = tokenlib.TokenManager(secret="shared", shared_cache=cache,
+                                        secret_cache_size=10)
+        forger = tokenlib.TokenManager(secret="forger")
+        now = time.time()
+        forged = forger.make_token({"uid": 1, "expires": 1e300})
+        manager.get_derived_secret(forged)
+        expires = cache.get(manager._get_shared_cache_key(forged))[0]
+        self.assertTrue(expires <= time.time() + manager.timeout)
+        self.assertTrue(expires >= now + manager.timeout)
+        later = time.time() + manager.timeout + 1
+        self.assertEqual(manager.secret_cache.get(forged, later), None)
+        cache.close()
+
+
+class TestSharedTokenCacheProcesses(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "tokens.cache")
+        self.pool = multiprocessing.get_context("spawn").Pool(4)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        self.tempdir.cleanup()
+
+    def test_processes_share_derived_secrets(self):
+        SharedTokenCache(self.path, size=1024).close()
+        manager = tokenlib.TokenManager(secret="shared")
+        tokens = [manager.make_token({"uid": i}) for i in range(50)]
+        expected = [(i, manager.get_derived_secret(token))
+                    for i, token in enumerate(tokens)]
+        # The first process derives every secret, and later processes find
+        # them all in the cache.
+        first = self.pool.apply(_parse_and_derive, (self.path, tokens))
+        self.assertEqual(first, (expected, 0))
+        outputs = self.pool.starmap(_parse_and_derive,
+                                    [(self.path, tokens)] * 4)
+        for results, hits in outputs:
+            self.assertEqual(results, expected)
+            self.assertEqual(hits, 50)
+
+    def test_concurrent_writers_never_produce_torn_reads(self):
+        SharedTokenCache(self.path, size=16).close()
+        torn = self.pool.starmap(_hammer,
+                                 [(self.path, i, 2000) for i in range(4)])
+        self.assertEqual(torn, [0, 0, 0, 0])
@@ -0,0 +1,98 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sys
+import threading
+import unittest
+
+import tokenlib
+from tokenlib import errors
+from tokenlib.metrics import InMemoryMetrics
+from tokenlib.revocation import RevocationFilter
+
+
+NUM_THREADS = 8
+NUM_TOKENS = 200
+
+
+def run_threads(target, num_threads=NUM_THREADS):
+    """Run target(i) in several threads at once, re-raising any error."""
+    barrier = threading.Barrier(num_threads)
+    results = [None] * num_threads
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except BaseException as e:  # pylint: disable=broad-except
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class TestThreads(unittest.TestCase):
+
+    def setUp(self):
+        # Switch threads as often as possible, to shake out any races.
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_token_manager_is_safe_for_concurrent_use(self):
+        metrics = InMemoryMetrics()
+        manager = tokenlib.TokenManager(secret_cache_size=100,
+                                        token_cache_size=100,
+                                        invalid_token_cache_size=100,
+                                        metrics=metrics,
+                                        revocation=RevocationFilter())
+        reference = tokenlib.TokenManager()
+        forged = tokenlib.make_token({"uid": 0}, secret="forged")
+
+        def work(i):
+            for j in range(NUM_TOKENS):
+                data = {"uid": i * NUM_TOKENS + j}
+                token = manager.make_token(data)
+                self.assertEqual(manager.parse_token(token)["uid"],
+                                 data["uid"])
+                self.assertEqual(manager.get_derived_secret(token),
+                                 reference.get_derived_secret(token))
+                with self.assertRaises(errors.InvalidSignatureError):
+                    manager.parse_token(forged)
+                if j % 10 == 0:
+                    manager.revoke_token(token)
+                    with self.assertRaises(errors.RevokedTokenError):
+                        manager.parse_token(token)
+
+        run_threads(work)
+        counters = metrics.snapshot()["counters"]
+        total = NUM_THREADS * NUM_TOKENS
+        self.assertEqual(counters["make_token"], total)
+        self.assertEqual(counters["get_derived_secret"], total)
+        self.assertEqual(counters["parse_token"], 2 * total + total // 10)
+        self.assertTrue(len(manager.token_cache) <= 100)
+
+    def test_threads_share_one_manager_per_settings(self):
+        registry = tokenlib.TokenManagerRegistry(max_size=4)
+
+        def lookup(i):
+            return [registry.get_manager(secret="secret%d" % (j % 4,))
+                    for j in range(i, i + 100)]
+
+        results = run_threads(lookup)
+        for j in range(4):
+            managers = set(id(result[(j - i) % 4])
+                           for i, result in enumerate(results))
+            self.assertEqual(len(managers), 1)
+        self.assertEqual(len(registry), 4)
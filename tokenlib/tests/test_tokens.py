@@ -3,6 +3,8 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import sys
+import json
+import pickle
 import hashlib
 import time
 import warnings
@@ -10,6 +12,8 @@ import unittest
 
 import tokenlib
 from tokenlib import errors
+from tokenlib.formats import TokenData
+from tokenlib.revocation import RevocationFilter
 from tokenlib.utils import encode_token_bytes, decode_token_bytes
 
 
@@ -108,3 +112,370 @@ class TestTokens(unittest.TestCase):
             tokenlib.get_token_secret(token)
             self.assertEquals(len(w), 1)
             self.assertEquals(w[0].category, DeprecationWarning)
+
+    def test_make_tokens_in_batch(self):
+        manager = tokenlib.TokenManager()
+        tokens = manager.make_tokens([{"test": i} for i in range(5)])
+        self.assertEqual(len(tokens), 5)
+        self.assertEqual(len(set(tokens)), 5)
+        expires = set()
+        for i, token in enumerate(tokens):
+            data = manager.parse_token(token)
+            self.assertEqual(data["test"], i)
+            expires.add(data["expires"])
+        # The clock is read only once for the whole batch.
+        self.assertEqual(len(expires), 1)
+
+    def test_make_tokens_reports_per_item_errors(self):
+        manager = tokenlib.TokenManager()
+        results = manager.make_tokens([{"a": 1}, {"b": object()}, {"c": 3}])
+        self.assertEqual(manager.parse_token(results[0])["a"], 1)
+        self.assertTrue(isinstance(results[1], TypeError))
+        self.assertEqual(manager.parse_token(results[2])["c"], 3)
+
+    def test_parse_tokens_in_batch(self):
+        manager = tokenlib.TokenManager()
+        good = manager.make_token({"test": "good"})
+        expired = manager.make_token({"test": "old", "expires": 1})
+        forged = tokenlib.TokenManager(secret="X").make_token({"test": "bad"})
+        results = manager.parse_tokens([good, "@" + good[1:], expired, forged])
+        self.assertEqual(results[0]["test"], "good")
+        self.assertTrue(isinstance(results[1], errors.MalformedTokenError))
+        self.assertTrue(isinstance(results[2], errors.ExpiredTokenError))
+        self.assertTrue(isinstance(results[3], errors.InvalidSignatureError))
+        results = manager.parse_tokens([good], now=9999999999)
+        self.assertTrue(isinstance(results[0], errors.ExpiredTokenError))
+        # Unusable data in a correctly-signed token doesn't abort the batch.
+        unusable = manager.make_token({"test": "odd", "expires": "soon"})
+        results = manager.parse_tokens([unusable, good])
+        self.assertTrue(isinstance(results[0], errors.MalformedTokenError))
+        self.assertEqual(results[1]["test"], "good")
+
+    def test_managers_can_be_pickled(self):
+        for backend in ("hmac", "python"):
+            manager = tokenlib.TokenManager(secret="pickled", backend=backend,
+                                            token_format="compact")
+            token = manager.make_token({"uid": 42})
+            other = pickle.loads(pickle.dumps(manager))
+            self.assertEqual(other.parse_token(token)["uid"], 42)
+            self.assertEqual(other.get_derived_secret(token),
+                             manager.get_derived_secret(token))
+            token = other.make_token({"uid": 7})
+            self.assertEqual(manager.parse_token(token)["uid"], 7)
+
+    def test_unusable_expiry_times_are_malformed(self):
+        revocation = RevocationFilter()
+        for token_format in ("json", "compact"):
+            manager = tokenlib.TokenManager(token_format=token_format,
+                                            revocation=revocation)
+            expiries = [float("inf"), float("-inf"), float("nan")]
+            if token_format == "json":
+                expiries.append("soon")
+            for expires in expiries:
+                token = manager.make_token({"expires": expires})
+                self.assertRaises(errors.MalformedTokenError,
+                                  manager.parse_token, token)
+                result = manager.parse_tokens([token])[0]
+                self.assertTrue(isinstance(result,
+                                           errors.MalformedTokenError))
+
+    def test_batches_can_use_a_thread_pool(self):
+        manager = tokenlib.TokenManager()
+        count = tokenlib.BATCH_CHUNK_SIZE * 3 + 7
+        datas = [{"test": i} for i in range(count)]
+        tokens = manager.make_tokens(datas, max_workers=4)
+        self.assertEqual(len(tokens), count)
+        results = manager.parse_tokens(tokens, max_workers=4)
+        self.assertEqual([r["test"] for r in results], list(range(count)))
+
+    def test_derived_secrets_can_be_cached(self):
+        manager = tokenlib.TokenManager(secret_cache_size=2)
+        uncached = tokenlib.TokenManager(secret=manager.secret)
+        tokens = manager.make_tokens([{"test": i} for i in range(3)])
+        for token in tokens:
+            self.assertEqual(manager.get_derived_secret(token),
+                             uncached.get_derived_secret(token))
+        self.assertEqual(manager.secret_cache.misses, 3)
+        self.assertEqual(len(manager.secret_cache), 2)
+        secret = manager.get_derived_secret(tokens[2])
+        self.assertEqual(secret, uncached.get_derived_secret(tokens[2]))
+        self.assertEqual(manager.secret_cache.hits, 1)
+        # Secrets are not cached beyond the expiry of their token.
+        expired = manager.make_token({"test": "old", "expires": 1})
+        manager.get_derived_secret(expired)
+        self.assertEqual(manager.secret_cache.get(expired), None)
+
+    def test_parsed_tokens_can_be_cached(self):
+        manager = tokenlib.TokenManager(token_cache_size=10)
+        token = manager.make_token({"hello": "world"})
+        data = manager.parse_token(token)
+        self.assertEqual(manager.token_cache.misses, 1)
+        # Callers get their own copy of the data to mutate.
+        data["hello"] = "mutated"
+        self.assertEqual(manager.parse_token(token)["hello"], "world")
+        self.assertEqual(manager.token_cache.hits, 1)
+        # Expiry is still enforced for cached tokens.
+        with self.assertRaises(errors.ExpiredTokenError):
+            manager.parse_token(token, now=9999999999)
+        result = manager.parse_tokens([token], now=9999999999)[0]
+        self.assertTrue(isinstance(result, errors.ExpiredTokenError))
+        self.assertEqual(manager.parse_token(token)["hello"], "world")
+        # Already-expired tokens are never cached.
+        expired = manager.make_token({"hello": "world", "expires": 1})
+        with self.assertRaises(errors.ExpiredTokenError):
+            manager.parse_token(expired)
+        self.assertEqual(manager.token_cache.get(expired), None)
+
+    def test_cached_tokens_do_not_share_nested_data(self):
+        for kwds in ({}, {"token_format": "compact"},
+                     {"lazy_token_data": True}):
+            manager = tokenlib.TokenManager(token_cache_size=10, **kwds)
+            token = manager.make_token({"scopes": ["read"]})
+            manager.parse_token(token)["scopes"].append("admin")
+            manager.parse_token(token)["scopes"].append("admin")
+            self.assertEqual(manager.parse_token(token)["scopes"], ["read"])
+            self.assertEqual(manager.token_cache.hits, 2)
+
+    def test_invalid_tokens_can_be_cached(self):
+        manager = tokenlib.TokenManager(invalid_token_cache_size=10,
+                                        invalid_token_cache_ttl=0.2)
+        forged = tokenlib.TokenManager(secret="X").make_token({"a": "b"})
+        with self.assertRaises(errors.InvalidSignatureError):
+            manager.parse_token(forged)
+        self.assertEqual(len(manager.invalid_token_cache), 1)
+        with self.assertRaises(errors.InvalidSignatureError):
+            manager.parse_token(forged)
+        self.assertEqual(manager.invalid_token_cache.hits, 1)
+        # Malformed tokens are rejected up front, without touching the cache.
+        with self.assertRaises(errors.MalformedTokenError):
+            manager.parse_token("@" + forged[1:])
+        self.assertEqual(len(manager.invalid_token_cache), 1)
+        self.assertEqual(manager.invalid_token_cache.hits, 1)
+        # Entries are forgotten after the configured ttl.
+        time.sleep(0.2)
+        self.assertEqual(manager.invalid_token_cache.get(forged), None)
+
+    def test_convenience_functions_reuse_managers(self):
+        manager = tokenlib.get_manager(secret="tenant1")
+        self.assertTrue(tokenlib.get_manager(secret=b"tenant1") is manager)
+        self.assertTrue(tokenlib.get_manager(secret="tenant2") is not manager)
+        self.assertTrue(tokenlib.get_manager(secret="tenant1",
+                                             timeout=10) is not manager)
+        token = tokenlib.make_token({"hello": "world"}, secret="tenant1")
+        self.assertEqual(manager.parse_token(token)["hello"], "world")
+
+    def test_manager_registry_is_bounded(self):
+        registry = tokenlib.TokenManagerRegistry(max_size=2)
+        manager1 = registry.get_manager(secret="one")
+        manager2 = registry.get_manager(secret="two")
+        self.assertTrue(registry.get_manager(secret="one") is manager1)
+        registry.get_manager(secret="three")
+        self.assertEqual(len(registry), 2)
+        self.assertTrue(registry.get_manager(secret="one") is manager1)
+        self.assertTrue(registry.get_manager(secret="two") is not manager2)
+        registry.clear()
+        self.assertEqual(len(registry), 0)
+
+    def test_compact_token_format(self):
+        manager = tokenlib.TokenManager(token_format="compact")
+        json_manager = tokenlib.TokenManager(secret=manager.secret)
+        data = {"uid": 42, "node": "https://example.com"}
+        token = manager.make_token(data)
+        json_token = json_manager.make_token(data)
+        self.assertTrue(len(token) < len(json_token))
+        # Both managers can parse tokens in either format.
+        for m in (manager, json_manager):
+            for t in (token, json_token):
+                parsed = m.parse_token(t)
+                self.assertEqual(parsed["uid"], 42)
+                self.assertEqual(parsed["node"], "https://example.com")
+                self.assertEqual(sorted(parsed.keys()),
+                                 ["expires", "node", "salt", "uid"])
+        self.assertEqual(manager.get_derived_secret(token),
+                         json_manager.get_derived_secret(token))
+        with self.assertRaises(errors.ExpiredTokenError):
+            manager.parse_token(token, now=9999999999)
+        self.assertRaises(ValueError, tokenlib.TokenManager,
+                          token_format="unknown")
+
+    def test_compact_tokens_are_checked_for_expiry_before_decoding(self):
+        manager = tokenlib.TokenManager(token_format="compact",
+                                        token_cache_size=10,
+                                        lazy_token_data=True)
+        token = manager.make_token({"uid": 42})
+        data = manager.parse_token(token)
+        self.assertTrue(data._data is None)
+        self.assertEqual(data["uid"], 42)
+        self.assertEqual(manager.parse_token(token)["uid"], 42)
+        self.assertEqual(manager.token_cache.hits, 1)
+        # An expired token is rejected having decoded only the header,
+        # so it never notices that this one has a malformed body.
+        payload = tokenlib.formats.encode_payload(
+            {"expires": 1, "salt": "abcdef"}, "compact") + b"NOTJSON"
+        token = encode_token_bytes(payload + manager._get_signature(payload))
+        with self.assertRaises(errors.ExpiredTokenError):
+            manager.parse_token(token)
+        data = manager.parse_token(token, now=0)
+        self.assertRaises(ValueError, data.get, "uid")
+        # Without lazy_token_data the body is decoded once the header has
+        # been checked.
+        eager = tokenlib.TokenManager(secret=manager.secret,
+                                      token_format="compact")
+        with self.assertRaises(errors.ExpiredTokenError):
+            eager.parse_token(token)
+        self.assertRaises(errors.MalformedTokenError, eager.parse_token,
+                          token, now=0)
+
+    def test_compact_tokens_parse_to_dicts(self):
+        manager = tokenlib.TokenManager(token_format="compact",
+                                        token_cache_size=10)
+        token = manager.make_token({"uid": 42, "scopes": ["read"]})
+        for _ in range(2):
+            data = manager.parse_token(token)
+            self.assertEqual(type(data), dict)
+            self.assertEqual(json.loads(json.dumps(data)), data)
+            data["uid"] = 7
+        # Parsed data of either kind can be used to make a new token.
+        lazy = tokenlib.TokenManager(secret=manager.secret,
+                                     token_format="compact",
+                                     lazy_token_data=True)
+        for parsed in (manager.parse_token(token), lazy.parse_token(token)):
+            again = manager.make_token(parsed)
+            self.assertEqual(manager.parse_token(again), dict(parsed))
+
+    def test_tokens_can_be_given_as_bytes(self):
+        manager = tokenlib.TokenManager(token_cache_size=10,
+                                        secret_cache_size=10)
+        token = manager.make_token({"hello": "world"})
+        secret = manager.get_derived_secret(token)
+        token_bytes = token.encode("ascii")
+        for value in (token_bytes, bytearray(token_bytes),
+                      memoryview(token_bytes)):
+            self.assertEqual(manager.parse_token(value)["hello"], "world")
+            self.assertEqual(manager.get_derived_secret(value), secret)
+        with self.assertRaises(errors.InvalidSignatureError):
+            manager.parse_token(bytearray(b"X" * 64))
+
+    def test_tokens_can_be_returned_as_bytes(self):
+        for token_format in ("json", "compact"):
+            manager = tokenlib.TokenManager(return_bytes=True,
+                                            token_format=token_format)
+            token = manager.make_token({"hello": "world"})
+            self.assertTrue(isinstance(token, bytes))
+            self.assertEqual(manager.parse_token(token)["hello"], "world")
+            secret = manager.get_derived_secret(token)
+            self.assertTrue(isinstance(secret, bytes))
+            self.assertEqual(manager.get_derived_secret(token.decode("ascii")),
+                             secret)
+
+    def test_tokens_can_be_revoked(self):
+        revocation = RevocationFilter()
+        manager = tokenlib.TokenManager(revocation=revocation,
+                                        token_cache_size=10)
+        token1 = manager.make_token({"test": 1})
+        token2 = manager.make_token({"test": 2})
+        self.assertEqual(manager.parse_token(token1)["test"], 1)
+        manager.revoke_token(token1)
+        # Revoked tokens are rejected, even if they were cached.
+        with self.assertRaises(errors.RevokedTokenError):
+            manager.parse_token(token1)
+        self.assertEqual(manager.parse_token(token2)["test"], 2)
+        # Revoking is idempotent, and does nothing for expired tokens.
+        manager.revoke_token(token1)
+        manager.revoke_token(manager.make_token({"test": 3, "expires": 1}))
+        self.assertEqual(len(revocation), 1)
+        # Forged tokens cannot be revoked.
+        forged = tokenlib.make_token({"test": 1}, secret="X")
+        with self.assertRaises(errors.InvalidSignatureError):
+            manager.revoke_token(forged)
+        # A filter shipped from another node applies to other managers.
+        other = tokenlib.TokenManager(
+            secret=manager.secret,
+            revocation=RevocationFilter.from_bytes(revocation.to_bytes()))
+        with self.assertRaises(errors.RevokedTokenError):
+            other.parse_token(token1)
+        self.assertRaises(ValueError, tokenlib.TokenManager().revoke_token,
+                          token1)
+
+    def test_multiple_derived_secrets_in_one_pass(self):
+        for token_format in ("json", "compact"):
+            manager = tokenlib.TokenManager(token_format=token_format)
+            token = manager.make_token({"hello": "world"})
+            secrets = manager.get_derived_secrets(
+                token, ["", "signing", "encryption"])
+            self.assertEqual(sorted(secrets), ["", "encryption", "signing"])
+            self.assertEqual(secrets[""], manager.get_derived_secret(token))
+            self.assertEqual(len(set(secrets.values())), 3)
+            # Secrets are stable, and specific to their token.
+            self.assertEqual(manager.get_derived_secrets(token, ["signing"]),
+                             {"signing": secrets["signing"]})
+            other = manager.make_token({"hello": "world"})
+            self.assertNotEqual(
+                manager.get_derived_secrets(other, ["signing"])["signing"],
+                secrets["signing"])
+        self.assertEqual(tokenlib.get_derived_secrets(token, [""]),
+                         {"": tokenlib.get_derived_secret(token)})
+        with self.assertRaises(errors.MalformedTokenError):
+            manager.get_derived_secrets("@" + token[1:], ["signing"])
+
+    def test_obviously_bad_tokens_are_rejected_early(self):
+        manager = tokenlib.TokenManager(max_token_length=200)
+        token = manager.make_token({"hello": "world"})
+        self.assertEqual(manager.parse_token(token)["hello"], "world")
+        bad_tokens = [
+            None,
+            "",
+            token[:40],
+            token[:-1],
+            token + "AAAA" * 50,
+            token[:-4] + "a b=",
+            token[:-4] + "A=A=",
+            token.encode("ascii")[:-4] + b"\xff\xff==",
+        ]
+        for bad_token in bad_tokens:
+            with self.assertRaises(errors.MalformedTokenError):
+                manager.parse_token(bad_token)
+            with self.assertRaises(errors.MalformedTokenError):
+                manager.get_derived_secret(bad_token)
+        # The shortest well-formed token still reaches signature checking.
+        short = encode_token_bytes(b"X" * (manager.hashmod_digest_size + 1))
+        with self.assertRaises(errors.InvalidSignatureError):
+            manager.parse_token(short)
+
+    def test_lazy_token_data(self):
+        manager = tokenlib.TokenManager(lazy_token_data=True,
+                                        token_cache_size=10)
+        token = manager.make_token({"uid": 42})
+        data = manager.parse_token(token)
+        self.assertTrue(isinstance(data, TokenData))
+        self.assertEqual(data["uid"], 42)
+        self.assertEqual(data["expires"], data.expires)
+        self.assertEqual(dict(data), tokenlib.parse_token(token))
+        self.assertEqual(manager.parse_token(token), data)
+        self.assertEqual(manager.token_cache.hits, 1)
+        # Tokens are parsed to dicts by default.
+        self.assertEqual(type(tokenlib.parse_token(token)), dict)
+
+    def test_large_tokens_can_be_compressed(self):
+        data = {"uid": 42, "scopes": ["https://identity.mozilla.com/apps/%d"
+                                      % i for i in range(50)]}
+        plain = tokenlib.TokenManager(token_format="compact")
+        manager = tokenlib.TokenManager(token_format="compact",
+                                        compress_threshold=256)
+        token = manager.make_token(data)
+        self.assertTrue(len(token) < len(plain.make_token(data)) / 2)
+        self.assertEqual(plain.parse_token(token)["scopes"], data["scopes"])
+        self.assertEqual(manager.parse_token(token)["uid"], 42)
+        self.assertEqual(manager.get_derived_secret(token),
+                         plain.get_derived_secret(token))
+        # Decompression is bounded, and happens only for valid tokens.
+        strict = tokenlib.TokenManager(token_format="compact",
+                                       max_decompressed_size=100)
+        self.assertRaises(errors.MalformedTokenError, strict.parse_token,
+                          token)
+        result = strict.parse_tokens([token])[0]
+        self.assertTrue(isinstance(result, errors.MalformedTokenError))
+        with self.assertRaises(errors.ExpiredTokenError):
+            strict.parse_token(token, now=time.time() + 3600)
+        with self.assertRaises(ValueError):
+            tokenlib.TokenManager(compress_threshold=256)
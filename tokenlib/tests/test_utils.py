@@ -7,7 +7,9 @@ import hashlib
 from binascii import unhexlify
 import unittest
 
-from tokenlib.utils import strings_differ, HKDF, HKDF_extract
+from tokenlib.utils import (strings_differ, HKDF, HKDF_extract,
+                            HKDF_expand, new_keyed_hmac, token_to_bytes,
+                            encode_token_bytes, decode_token_bytes)
 
 
 class TestUtils(unittest.TestCase):
@@ -49,3 +51,38 @@ class TestUtils(unittest.TestCase):
               unhexlify(b"673a081d70cce7acfc48")
         self.assertEquals(HKDF_extract(salt, IKM, hashmod), PRK)
         self.assertEquals(HKDF(IKM, salt, info, L, hashmod), OKM)
+
+    def test_hkdf_accepts_pre_keyed_hmac_objects(self):
+        for hashmod in (hashlib.sha1, hashlib.sha256, hashlib.sha512):
+            salt = b"some salt"
+            IKM = b"input keying material"
+            PRK = HKDF_extract(salt, IKM, hashmod)
+            keyed_salt = new_keyed_hmac(salt, hashmod)
+            self.assertEqual(HKDF_extract(keyed_salt, IKM, hashmod), PRK)
+            # The keyed object must be left untouched for re-use.
+            self.assertEqual(HKDF_extract(keyed_salt, IKM, hashmod), PRK)
+            OKM = HKDF_expand(PRK, b"info", 100, hashmod)
+            keyed_PRK = new_keyed_hmac(PRK, hashmod)
+            self.assertEqual(HKDF_expand(keyed_PRK, b"info", 100, hashmod),
+                             OKM)
+            self.assertEqual(HKDF(IKM, salt, b"info", 100, hashmod), OKM)
+
+    def test_hkdf_accepts_bytearray_keys(self):
+        OKM = HKDF(b"secret", b"salt", b"info", 32)
+        for backend in ("python", "hmac"):
+            self.assertEqual(HKDF(b"secret", bytearray(b"salt"), b"info", 32,
+                                  backend=backend), OKM)
+            PRK = bytearray(HKDF_extract(b"salt", b"secret", backend=backend))
+            self.assertEqual(HKDF_expand(PRK, b"info", 32, backend=backend),
+                             OKM)
+
+    def test_token_codecs_accept_bytes_like_objects(self):
+        data = b"\x00\x01token data\xff"
+        token = encode_token_bytes(data)
+        self.assertTrue(isinstance(token, str))
+        token_bytes = encode_token_bytes(data, as_bytes=True)
+        self.assertEqual(token_bytes, token.encode("ascii"))
+        for value in (token, token_bytes, bytearray(token_bytes),
+                      memoryview(token_bytes)):
+            self.assertEqual(decode_token_bytes(value), data)
+            self.assertEqual(token_to_bytes(value), token_bytes)
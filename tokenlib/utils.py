@@ -3,78 +3,94 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=C0103
 
-import sys
 import math
 import hmac
 import base64
 import hashlib
 
+from tokenlib.backends import get_backend
+# Re-exported from here for backwards-compatibility.
+from tokenlib.backends import strings_differ  # noqa: F401 pylint: disable=W0611
 
-if sys.version_info > (3,):  # pragma: nocover
-    IS_PY3 = True
-    xrange = range
-    byte_to_int = lambda x: x
-    int_to_byte = lambda x: bytes((x,))
-else:  # pragma: nocover
-    IS_PY3 = False
-    byte_to_int = ord
-    int_to_byte = chr
 
+def new_keyed_hmac(key, hashmod=hashlib.sha256):
+    """Create a HMAC object that has been keyed but not yet fed any data.
 
-def strings_differ(string1, string2):
-    """Check whether two bytestrings differ while avoiding timing attacks.
+    Keying a HMAC object hashes the padded key into its inner and outer
+    states.  Code that computes many HMACs under the same key can call
+    this once and then copy() the result for each message, rather than
+    paying for the keying step every time.
 
-    This function returns True if the given strings differ and False
-    if they are equal.  It's careful not to leak information about *where*
-    they differ as a result of its running time, which can be very important
-    to avoid certain timing-related crypto attacks:
+    The helpers in this module only ever copy such objects, never update
+    them, so one may safely be shared between threads; but on free-threaded
+    builds, threads that copy the same object at once contend for it, so
+    heavily threaded code should create one per thread.
+    """
+    return hmac.new(key, digestmod=hashmod)
 
-        http://seb.dbzteam.org/crypto/python-oauth-timing-hmac.pdf
 
-    """
-    if len(string1) != len(string2):
-        return True
-    invalid_bits = 0
-    for a, b in zip(string1, string2):
-        invalid_bits += byte_to_int(a) ^ byte_to_int(b)
-    return invalid_bits != 0
+def _is_keyed_hmac(key):
+    """Check whether a key is a pre-keyed HMAC object, rather than bytes."""
+    return hasattr(key, "digest_size")
+
 
+def _hmac_digest(key, data, hashmod, backend):
+    """Compute a HMAC under the given key or pre-keyed HMAC object."""
+    if not _is_keyed_hmac(key):
+        return backend.hmac_digest(key, data, hashmod)
+    h = key.copy()
+    h.update(data)
+    return h.digest()
 
-def HKDF_extract(salt, IKM, hashmod=hashlib.sha256):
-    """HKDF-Extract; see RFC-5869 for the details."""
+
+def HKDF_extract(salt, IKM, hashmod=hashlib.sha256, backend=None):
+    """HKDF-Extract; see RFC-5869 for the details.
+
+    The salt may be given either as a bytestring or as a HMAC object
+    pre-keyed with the salt via new_keyed_hmac().
+    """
+    backend = get_backend(backend)
     if salt is None:
         salt = b"\x00" * hashmod().digest_size
-    return hmac.new(salt, IKM, hashmod).digest()
+    return _hmac_digest(salt, IKM, hashmod, backend)
 
 
-def HKDF_expand(PRK, info, L, hashmod=hashlib.sha256):
-    """HKDF-Expand; see RFC-5869 for the details."""
-    digest_size = hashmod().digest_size
+def HKDF_expand(PRK, info, L, hashmod=hashlib.sha256, backend=None):
+    """HKDF-Expand; see RFC-5869 for the details.
+
+    The PRK may be given either as a bytestring or as a HMAC object
+    pre-keyed with the PRK via new_keyed_hmac().
+    """
+    backend = get_backend(backend)
+    if _is_keyed_hmac(PRK):
+        digest_size = PRK.digest_size
+    else:
+        digest_size = hashmod().digest_size
     N = int(math.ceil(L * 1.0 / digest_size))
     assert N <= 255
     T = b""
     output = []
-    for i in xrange(1, N + 1):
-        data = T + info + int_to_byte(i)
-        T = hmac.new(PRK, data, hashmod).digest()
+    for i in range(1, N + 1):
+        data = T + info + bytes((i,))
+        T = _hmac_digest(PRK, data, hashmod, backend)
         output.append(T)
     return b"".join(output)[:L]
 
 
-def HKDF(secret, salt, info, size, hashmod=hashlib.sha256):
+def HKDF(secret, salt, info, size, hashmod=hashlib.sha256, backend=None):
     """HKDF-extract-and-expand as a single function."""
-    PRK = HKDF_extract(salt, secret, hashmod)
-    return HKDF_expand(PRK, info, size, hashmod)
+    PRK = HKDF_extract(salt, secret, hashmod, backend)
+    return HKDF_expand(PRK, info, size, hashmod, backend)
 
 
-def encode_token_bytes(data):
+def encode_token_bytes(data, as_bytes=False):
     """Encode token data from bytes into a native string.
 
     This function base64-encodes binary data representing a token into a
-    urlsafe native string.
+    urlsafe native string, or into bytes if as_bytes is true.
     """
     data = base64.urlsafe_b64encode(data)
-    if IS_PY3:  # pragma: nocover
+    if not as_bytes:
         data = data.decode("ascii")
     return data
 
@@ -83,8 +99,23 @@ def decode_token_bytes(data):
     """Decode token data from a native string into bytes.
 
     This function base64-decodes binary data representing a token from a
-    urlsafe native string.
+    urlsafe native string.  The data may also be given as any bytes-like
+    object, such as bytes, bytearray or memoryview, in which case it is
+    decoded directly without first being copied.
     """
-    if IS_PY3:  # pragma: nocover
+    if isinstance(data, str):
         data = data.encode("ascii")
     return base64.urlsafe_b64decode(data)
+
+
+def token_to_bytes(token):
+    """Get the given token as a bytestring.
+
+    Tokens may be given either as native strings or as bytes-like objects;
+    this converts them to bytes, which can be hashed and concatenated.
+    """
+    if isinstance(token, bytes):
+        return token
+    if isinstance(token, str):
+        return token.encode("ascii")
+    return bytes(token)